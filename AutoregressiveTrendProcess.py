@@ -1,8 +1,8 @@
 from pprint import pprint
-import random
 
 import numpy as np
 
+from Discretizer import Discretizer
 from Environment import Environment
 from utils import plot_line_graph
 
@@ -23,20 +23,38 @@ class AutoregressiveTrendProcess(Environment):
         self.prices = []
         super().__init__(actions)
 
+    def generate_paths(self, M, rng=None):
+        # generates M independent paths of T trend, noise and price values at once, in O(M*T)
+        # input: M (int), rng (numpy Generator, RandomStream or None for the environment's own stream)
+        # output: trends, noises, prices (arrays of shape (M, T))
+        rng = self.rng if rng is None else rng
+        noise_shocks = rng.normal(size=(M, self.T))
+        trend_shocks = rng.normal(size=(M, self.T - 1))
+        # the noise is an AR(1) process: b_t = kappa * b_t-1 + N(0, 1)
+        noises = np.empty((M, self.T))
+        noises[:, 0] = noise_shocks[:, 0]
+        for t in range(1, self.T):
+            noises[:, t] = self.kappa * noises[:, t-1] + noise_shocks[:, t]
+        # the trend is a random walk driven by the noise: a_t = a_t-1 + b_t-1 + Lambda * N(0, 1)
+        trends = np.ones((M, self.T))
+        trends[:, 1:] += np.cumsum(noises[:, :-1] + self.Lambda * trend_shocks, axis=1)
+        # the range of each path is computed once, not per price
+        trend_range = trends.max(axis=1, keepdims=True) - trends.min(axis=1, keepdims=True)
+        prices = np.exp(trends / trend_range)
+        return trends, noises, prices
+
     def set_start(self):
-        # compute all T trend and noise values
-        self.trends = [1]
-        self.noises = [np.random.normal()]
-        for _ in range(self.T-1):
-            self.trends.append(self.trends[-1] + self.noises[-1] + self.Lambda * np.random.normal())
-            self.noises.append(self.kappa * self.noises[-1] + np.random.normal())
-        # now compute all T prices
-        for t in range(self.T):
-            self.prices.append(np.exp(self.trends[t] / (max(self.trends) - min(self.trends))))
+        # compute all T trend, noise and price values of a new path
+        trends, noises, prices = self.generate_paths(1)
+        self.trends, self.noises, self.prices = trends[0], noises[0], prices[0]
         # set the starting state
         starting_price = self.prices[0]
         super().set_start((starting_price, 0, 0, 0, starting_price, starting_price))
 
+    def reset(self):
+        # every episode runs on a new price path
+        self.set_start()
+
     def state_is_terminal(self, state) -> bool:
         if state[3] == self.T-1:
             return True
@@ -61,6 +79,43 @@ class AutoregressiveTrendProcess(Environment):
         if new_state is None: raise Exception("new_state is None, that's illegal!")
         return new_state[1]
 
+    def features(self, state):
+        # continuous features of a state for discretization (see Discretizer.py):
+        # position of the price in the range seen so far (0 = min, 1 = max), previous action, progress in time (0 to 1)
+        # state can also be an (M, 6) array of states, then the output is an (M, 3) array
+        price, _, previous_action, t, price_min, price_max = np.asarray(state, dtype=np.float64).T
+        price_range = price_max - price_min
+        position = np.divide(price - price_min, price_range, out=np.full_like(price_range, .5), where=price_range > 0)
+        return np.stack([position, previous_action, t / (self.T - 1)], axis=-1)
+
+    def discretizer(self, n_position_bins=10, n_time_bins=5):
+        # Discretizer over self.features, use it with DiscretizedEnvironment for tabular learners
+        return Discretizer([
+            np.linspace(0, 1, n_position_bins + 1)[1:-1],
+            [-.5, .5], # short, neutral, long
+            np.linspace(0, 1, n_time_bins + 1)[1:-1],
+        ], features=self.features)
+
+    def simulate_batch(self, policy, M, rng=None):
+        # trades on M new price paths at once, every path runs from t=0 until the terminal time-step T-1
+        # input: policy (callable that maps an (M, 6) array of states to an (M,) array of actions,
+        #                e.g. DiscretizedEnvironment.vectorized_policy, or a single action for every state),
+        #        M (int), rng (see generate_paths)
+        # output: pnl (array (M,), total reward of every path), rewards (array (M, T-1))
+        _, _, prices = self.generate_paths(M, rng)
+        # the columns are the entries of a state tuple (price, reward, previous_action, t, min_price, max_price)
+        states = np.zeros((M, 6))
+        states[:, 0] = states[:, 4] = states[:, 5] = prices[:, 0]
+        rewards = np.zeros((M, self.T - 1))
+        for t in range(self.T - 1):
+            actions = policy(states) if callable(policy) else np.full(M, policy)
+            # same dynamics as apply_action
+            price_old, price_new = prices[:, t], prices[:, t+1]
+            rewards[:, t] = (price_new - price_old) * (actions >= 0) - np.abs(self.transaction_cost * actions * price_new)
+            states = np.stack([price_new, rewards[:, t], actions, np.full(M, t+1),
+                               np.minimum(states[:, 4], price_new), np.maximum(states[:, 5], price_new)], axis=1)
+        return rewards.sum(axis=1), rewards
+
     def print_state(self,  state):
         print("Trend: ", state[0])
         print("Reward: ", state[1])
@@ -81,7 +136,7 @@ def main():
     print(f"Running {T} time-steps, picking random actions ...")
     for t in range(T):
         # perform a single random action
-        a = random.choice(env.actions)
+        a = env.rng.choice(env.actions)
         s = env.apply_action(s, a)
         a=0
         # and collect the reward
@@ -95,5 +150,13 @@ def main():
     plot_line_graph()
 
 
+
+def test_batch_simulation(M=10000, T=100):
+    # P&L of the constant strategies on M paths
+    env = AutoregressiveTrendProcess(T=T)
+    for a, name in zip(env.actions, ["long", "neutral", "short"]):
+        pnl, _ = env.simulate_batch(a, M)
+        print(f"Always {name}: mean P&L {pnl.mean():.4f} (std {pnl.std():.4f})")
+
 if __name__ == "__main__":
     main()
@@ -4,7 +4,8 @@
 
 
 from pprint import pprint
-import random
+
+import numpy as np
 
 from Environment import Environment
 
@@ -48,12 +49,12 @@ class BlackJack(Environment):
             # Player gets his first card
             # Player gets his second card
             for i in range(2):
-                new_card = BlackJack.draw_card()
+                new_card = self.draw_card()
                 state[0] += new_card
                 if new_card == 1:
                     state[1] += 1
             # Dealer gets his first card, it is the open-faced card
-            new_card = BlackJack.draw_card()
+            new_card = self.draw_card()
             state[3] += new_card
             # Dealer gets the rest of his cards at the end
             self.starting_state = tuple(state)
@@ -68,20 +69,49 @@ class BlackJack(Environment):
             value_sum += 10
         return value_sum
 
-    @staticmethod
-    def draw_card():
+    def draw_card(self):
         # randomly draws one card from the Blackjack deck
-        return random.choice(BlackJack.cards)
+        return self.rng.choice(BlackJack.cards)
+
+    # cache of reachable_states
+    reachable_states_cache = None
 
     @staticmethod
     def state_generator():
-        # generates all valid state combinations of the Blackjack environment
-        for pv in range(0, 31): # player_value
-            for pa in range(0, 12): # player_usable_ace
-                if pa > pv: continue # you cannot have any aces with a sum of 0
-                for ps in range(2): # player_sticks
-                    for dv in range(0, 11): # dealer_facing_value
-                                yield pv, pa, ps, dv
+        # generates all states of the Blackjack environment that can actually occur in a game
+        yield from BlackJack.reachable_states()
+
+    @staticmethod
+    def reachable_states():
+        # all states reachable from the dealt starting states (two player cards and the dealer's facing card)
+        # and from the zero-state of reset_game, found by a forward search over the player's actions
+        # terminal states carry the dealer's final value, just like the states apply_action returns
+        # computed once and cached, output: list of states
+        if BlackJack.reachable_states_cache is None:
+            card_values = sorted(set(BlackJack.cards))
+            starting_states = {(0, 0, 0, 0)}
+            for first in card_values:
+                for second in card_values:
+                    for facing in card_values:
+                        starting_states.add((first + second, (first == 1) + (second == 1), 0, facing))
+            reachable = set(starting_states)
+            stack = list(starting_states)
+            while stack:
+                state = stack.pop()
+                pv, pa, ps, dv = state
+                if BlackJack.state_is_terminal(state): continue
+                # hit with every card, or stick
+                next_states = [(pv + card, pa + (card == 1), 0, dv) for card in card_values] + [(pv, pa, 1, dv)]
+                for next_state in next_states:
+                    if BlackJack.state_is_terminal(next_state):
+                        # the hand is over and the dealer plays his full hand
+                        for dealer_value in BlackJack.dealer_distribution(dv):
+                            reachable.add(next_state[:3] + (dealer_value,))
+                    elif next_state not in reachable:
+                        reachable.add(next_state)
+                        stack.append(next_state)
+            BlackJack.reachable_states_cache = sorted(reachable)
+        return BlackJack.reachable_states_cache
 
     @staticmethod
     def print_state(state):
@@ -113,6 +143,10 @@ class BlackJack(Environment):
         return True
 
 
+    def legal_actions_key(self, state):
+        # legality only depends on the value of the player's hand, so all states share two cache entries
+        return self.get_value(state[0], state[1]) >= 21
+
     def apply_action(self, state:tuple, action:str) -> tuple:
         # applies a player's action and returns the resulting state
         # # if the game just started, i.e. both players have 0 values, make each of them draw 2 cards
@@ -122,7 +156,7 @@ class BlackJack(Environment):
         if action == "hit":
             # print("Entry state", state)
             # draw another card
-            new_card = BlackJack.draw_card()
+            new_card = self.draw_card()
             new_state[0] = state[0] + new_card
             if new_card == 1: new_state[1] += 1
             # if the player now has 21, he doesn't automatically win,
@@ -145,21 +179,179 @@ class BlackJack(Environment):
     # new strategy: the player plays this full hand and then the dealer also plays his full hand
     # this means the states are independent of the dealer-cards except his starting card
     # therefore: here is a function that computes a full dealer-hand using only the starting card
+    # the distribution of the dealer's final value only depends on the facing card,
+    # so it is computed exactly once per facing card (see dealer_distribution) and sampled from here
+    def dealer_full_turn(self, facing_value):
+        # samples the final value of a dealer who draws until he is >= 17 or goes bust
+        values, cum_weights = BlackJack.dealer_sampling_table(facing_value)
+        return self.rng.weighted_choice(values, cum_weights)
+
+    # cache of dealer_distribution: facing value -> {final value: probability}
+    dealer_distributions = {}
+
+    @staticmethod
+    def card_probabilities():
+        # probability of drawing each card value, e.g. {1: 1/13, ..., 10: 4/13}
+        return {card: BlackJack.cards.count(card) / len(BlackJack.cards) for card in sorted(set(BlackJack.cards))}
+
     @staticmethod
-    def dealer_full_turn(facing_value):
-        # draw cards until the dealer is > 17 or goes bust
-        total_dealer_value = facing_value
-        usable_aces = facing_value == 1
-        while True:
-            new_card = BlackJack.draw_card()
-            if new_card == 1: usable_aces = True
-            total_dealer_value += new_card
-            if BlackJack.get_value(total_dealer_value, usable_aces) >= 17:
-                # the dealer sticks when he gets higher than 17 or goes bust
-                break
-        return total_dealer_value
+    def dealer_distribution(facing_value):
+        # exact distribution of the dealer's final value given his facing card, computed once and cached
+        # the dealer always draws at least one more card and stops as soon as his value is >= 17
+        # output: dict {final value: probability}
+        if facing_value not in BlackJack.dealer_distributions:
+            distribution = {}
+            card_probabilities = BlackJack.card_probabilities()
+            # all ways the dealer's hand can continue from (total, usable_ace), reached with probability prob
+            def play(total, usable_ace, prob):
+                for card, p in card_probabilities.items():
+                    new_total, new_usable_ace = total + card, usable_ace or card == 1
+                    value = BlackJack.get_value(new_total, new_usable_ace)
+                    if value >= 17:
+                        distribution[value] = distribution.get(value, 0) + prob * p
+                    else:
+                        play(new_total, new_usable_ace, prob * p)
+            play(facing_value, facing_value == 1, 1)
+            BlackJack.dealer_distributions[facing_value] = dict(sorted(distribution.items()))
+        return BlackJack.dealer_distributions[facing_value]
 
+    @staticmethod
+    def dealer_sampling_table(facing_value):
+        # final values and cumulative probabilities of dealer_distribution, for sampling
+        distribution = BlackJack.dealer_distribution(facing_value)
+        return list(distribution.keys()), list(np.cumsum(list(distribution.values())))
 
+    # cache of get_possible_outcomes: (state, action) -> {new_state: probability}
+    outcomes_cache = {}
+
+    def get_possible_outcomes(self, state, action):
+        # exact outcome distribution of an action: all cards the player can draw and,
+        # if the hand ends, all final values of the dealer
+        # the outcomes only depend on state and action, so every distribution is computed once and cached
+        # input: state (tuple), action (str); output: dict {new_state: probability}
+        if action is None:
+            return None
+        if (state, action) in BlackJack.outcomes_cache:
+            return BlackJack.outcomes_cache[(state, action)]
+        if action == "hit":
+            player_outcomes = {}
+            for card, p in BlackJack.card_probabilities().items():
+                new_state = (state[0] + card, state[1] + (card == 1), state[2], state[3])
+                player_outcomes[new_state] = player_outcomes.get(new_state, 0) + p
+        else:
+            player_outcomes = {(state[0], state[1], 1, state[3]): 1}
+        outcomes = {}
+        for new_state, p in player_outcomes.items():
+            if not BlackJack.state_is_terminal(new_state):
+                outcomes[new_state] = outcomes.get(new_state, 0) + p
+                continue
+            # the hand is over: the dealer plays his full hand from his facing card
+            for dealer_value, q in BlackJack.dealer_distribution(state[3]).items():
+                final_state = new_state[:3] + (dealer_value,)
+                outcomes[final_state] = outcomes.get(final_state, 0) + p * q
+        BlackJack.outcomes_cache[(state, action)] = outcomes
+        return outcomes
+
+
+    @staticmethod
+    def get_value_batch(value_sums, usable_aces):
+        # vectorized get_value, input: value_sums (int array), usable_aces (int or bool array)
+        return np.where((usable_aces > 0) & (value_sums + 10 <= 21), value_sums + 10, value_sums)
+
+    @staticmethod
+    def draw_cards(n, rng):
+        # draws n cards at once, input: n (int), rng (numpy Generator or RandomStream); output: int array (n,)
+        return np.array(BlackJack.cards)[(rng.random(n) * len(BlackJack.cards)).astype(np.int64)]
+
+    @staticmethod
+    def dealer_full_turn_batch(facing_values, rng):
+        # vectorized dealer_full_turn: samples the final dealer values from the exact distributions
+        # input: facing_values (int array), rng; output: int array of final dealer values
+        values = np.arange(17, 27)
+        cdf = np.zeros((11, len(values)))
+        for facing_value in range(11):
+            distribution = BlackJack.dealer_distribution(facing_value)
+            cdf[facing_value] = np.cumsum([distribution.get(value, 0) for value in values])
+        u = rng.random(len(facing_values))
+        return values[np.minimum((u[:, None] > cdf[facing_values]).sum(axis=1), len(values) - 1)]
+
+    @staticmethod
+    def get_reward_batch(player_values, player_aces, dealer_values):
+        # vectorized get_reward for terminal states, see get_reward
+        player_values = BlackJack.get_value_batch(player_values, player_aces)
+        wins = ((dealer_values < player_values) & (player_values <= 21)) | ((player_values <= 21) & (dealer_values > 21))
+        losses = ((player_values < dealer_values) & (dealer_values <= 21)) | ((dealer_values <= 21) & (player_values > 21))
+        return wins.astype(np.int64) - losses.astype(np.int64)
+
+    @staticmethod
+    def hit_probabilities(policy, epsilon=-1):
+        # turns a policy {state: {action: prob}} (e.g. Bot.policy) into a lookup table of hit probabilities
+        # the table mirrors Bot.pick_action: the more probable action is picked, ties are random,
+        # and with epsilon a random action is picked instead
+        # states the policy does not know are played randomly
+        # output: float array of shape (21, 21, 11), indexed by [player_value, player_usable_aces, dealer_value]
+        p_hit = np.full((21, 21, 11), .5)
+        for pv, pa, ps, dv in BlackJack.state_generator():
+            if BlackJack.state_is_terminal((pv, pa, ps, dv)) or (pv, pa, ps, dv) not in policy: continue
+            rule = policy[(pv, pa, ps, dv)]
+            hit, stick = rule.get("hit", 0), rule.get("stick", 0)
+            p_hit[pv, pa, dv] = 1 if hit > stick else 0 if hit < stick else .5
+        if epsilon > 0:
+            p_hit = epsilon * .5 + (1 - epsilon) * p_hit
+        return p_hit
+
+    def play_batch(self, n, policy=None, epsilon=-1, T=20, rng=None, return_trajectories=False):
+        # plays n hands at once: deals, lets the player follow the policy, then resolves all dealers
+        # input: n (int), policy (dict {state: {action: prob}}, a (21, 21, 11) array of hit probabilities,
+        #        or None for random play), epsilon (float, exploration like in Bot.pick_action),
+        #        T (int, max number of player actions), rng (numpy Generator, RandomStream or None for the environment's own stream),
+        #        return_trajectories (bool)
+        # output: rewards (int array (n,)), and if return_trajectories also
+        #         states (int array (n, T, 4), the visited states, padded with -1),
+        #         actions (int array (n, T), 0 = "hit", 1 = "stick", -1 = padding),
+        #         lengths (int array (n,), number of player actions of every hand)
+        if rng is None: rng = self.rng
+        if policy is None:
+            p_hit = np.full((21, 21, 11), .5)
+        elif isinstance(policy, np.ndarray):
+            p_hit = policy
+        else:
+            p_hit = BlackJack.hit_probabilities(policy, epsilon)
+        # deal: two cards for the player, the facing card for the dealer
+        first, second = BlackJack.draw_cards(n, rng), BlackJack.draw_cards(n, rng)
+        player_values = first + second
+        player_aces = (first == 1).astype(np.int64) + (second == 1)
+        player_sticks = np.zeros(n, dtype=np.int64)
+        dealer_values = BlackJack.draw_cards(n, rng)
+        if return_trajectories:
+            states = np.full((n, T, 4), -1, dtype=np.int64)
+            actions = np.full((n, T), -1, dtype=np.int64)
+        lengths = np.zeros(n, dtype=np.int64)
+        terminal = BlackJack.get_value_batch(player_values, player_aces) >= 21
+        for t in range(T):
+            playing = np.flatnonzero(~terminal)
+            if len(playing) == 0: break
+            pv, pa, dv = player_values[playing], player_aces[playing], dealer_values[playing]
+            hits = rng.random(len(playing)) < p_hit[pv, pa, dv]
+            if return_trajectories:
+                states[playing, t] = np.stack([pv, pa, player_sticks[playing], dv], axis=1)
+                actions[playing, t] = np.where(hits, 0, 1)
+            lengths[playing] += 1
+            hitting = playing[hits]
+            new_cards = BlackJack.draw_cards(len(hitting), rng)
+            player_values[hitting] += new_cards
+            player_aces[hitting] += new_cards == 1
+            player_sticks[playing[~hits]] = 1
+            terminal[playing] = (player_sticks[playing] == 1) | \
+                                (BlackJack.get_value_batch(player_values[playing], player_aces[playing]) >= 21)
+        # hands that did not finish within T actions get no reward, like in Bot.episode
+        rewards = np.zeros(n, dtype=np.int64)
+        finished = np.flatnonzero(terminal)
+        dealer_finals = BlackJack.dealer_full_turn_batch(dealer_values[finished], rng)
+        rewards[finished] = BlackJack.get_reward_batch(player_values[finished], player_aces[finished], dealer_finals)
+        if return_trajectories:
+            return rewards, states, actions, lengths
+        return rewards
 
     def get_reward(self, state, action, new_state):
         # calculates reward based on terminal outcome
@@ -4,39 +4,51 @@
 
 
 
-import random
+from concurrent.futures import ProcessPoolExecutor
+import os
 
 import numpy as np
 
 from GridWorld import GridWorld
 from BlackJack import BlackJack
+from Policy import GreedyPolicy, TabularPolicy
+from RandomStream import RandomStream
 
 
 class Bot():
-    def __init__(self, env, T=100, initialize_policy=True):
+    def __init__(self, env, T=100, initialize_policy=True, seed=None):
         self.T = T # max number of time steps the agent is allowed to take
         # the environment contains states and actions
         self.env = env
+        # own random stream for picking actions, with a seed the environment is seeded as well (see seed)
+        self.rng = RandomStream()
+        if seed is not None:
+            self.seed(seed)
         # in the scriptum the policy is often referred to as a vector of length S, containing actions
         # I opted to use a dictionary that maps from states to actions to probabilities of using that action in that state
         # self.policy: pi(a|s) -> [0, 1]
+        # it is stored as a TabularPolicy (see Policy.py), an (S, A) array that can still be used like that dictionary
         # I initialize them as equiprobable, which leads to random action-picking
 
         # initialize_policy: boolean
         # you may not want to initialize a policy, because e.g. in MC, precomputing all states may
-        # not be necessary
-        self.policy = {}
+        # not be necessary, states then get added to the policy when they are first visited
+        self.policy = TabularPolicy(env.actions, legal_mask=env.legal_mask)
         if initialize_policy:
             self.init_policy()
 
+    def seed(self, seed=None):
+        # seeds the bot and its environment with two independent streams spawned from one seed
+        # input: seed (int, SeedSequence or None); output: none
+        seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        bot_seed, env_seed = seed_sequence.spawn(2)
+        self.rng = RandomStream(bot_seed)
+        self.env.seed(env_seed)
+
     def init_policy(self, hardline=False):
         # initializes the policy with equal probabilities for possible actions
         # input: hardline (bool); output: none
-        for s in self.env.state_generator():
-            possible_actions = [a for a in self.env.actions if (self.env.is_this_action_possible(s, a))]
-            self.policy[s] = {}
-            for a in self.env.actions:
-                self.policy[s].update({a: 1 / len(possible_actions) if a in possible_actions else 0})
+        self.policy = TabularPolicy(self.env.actions, self.env.state_generator(), self.env.legal_mask)
         if hardline: self.hardline_policy()
 
     # policy is typically a probability of all possible actions in a given state
@@ -57,9 +69,20 @@ class Bot():
         # with this function you can update a policy to set all actions for a given state to a probability of 0
         # except for the action a_new, which will get a probability of 1
         if policy is None: policy = self.policy
+        # policy objects like GreedyPolicy know how to fix an action themselves
+        if hasattr(policy, "set_action"):
+            policy.set_action(s, a_new)
+            return
         for a in policy[s].keys():
             policy[s][a] = 1 if a == a_new else 0
 
+    def set_greedy_policy(self, q):
+        # replaces the policy with a view that is always greedy w.r.t. the action-values q (e.g. a QTable)
+        # the view is derived from q on access, so it never has to be rebuilt when q changes (see Policy.py)
+        # input: q (QTable or similar); output: GreedyPolicy
+        self.policy = GreedyPolicy(q)
+        return self.policy
+
 
     # function for picking the best action from a policy, draws are resolved randomly
     # you can supply an epsilon for epsilon greedy exploration-exploitation
@@ -70,62 +93,38 @@ class Bot():
             policy = self.policy
         if self.env.state_is_terminal(s_t):
             return None
+        # a tabular policy samples epsilon-greedy from its arrays and adds unknown states itself
+        if isinstance(policy, TabularPolicy):
+            return policy.sample_action(s_t, epsilon, self.rng)
         # TODO: if the state is unknown to the policy, compute a new ruleset
-        if s_t not in policy.keys():
-            possible_actions = [a for a in self.env.actions if self.env.is_this_action_possible(s_t, a)]
+        if s_t not in policy:
+            possible_actions = self.env.legal_actions(s_t)
             policy[s_t] = {a:1/len(possible_actions) for a in possible_actions}
 
         # generate a random uniform number
         # if it is smaller than epsilon, we explore, otherwise we exploit normally
         ##### EXPLORE #####
-        if random.random() < epsilon:
+        if self.rng.random() < epsilon:
             # do not pick any impossible action though
-            return random.choice(list(a for a in policy[s_t].keys() if self.env.is_this_action_possible(s_t, a)))
+            possible_actions = self.env.legal_actions(s_t)
+            # the rows of a greedy policy contain every action, so no need to look at them
+            if isinstance(policy, GreedyPolicy):
+                return self.rng.choice(possible_actions)
+            return self.rng.choice([a for a in policy[s_t].keys() if a in possible_actions])
         ##### EXPLOIT #####
+        elif isinstance(policy, GreedyPolicy):
+            # a greedy policy knows its best action without looking at all probabilities
+            return policy.greedy_action(s_t)
         else:
             # get the action with the highest probability given the current state from the policy
             max_prob = max(policy[s_t].values())
             # get all actions for this state that have the max probability
             best_keys = [k for k, v in policy[s_t].items() if v == max_prob]
             # pick a random action from the most likely ones
-            chosen_key = random.choice(best_keys)
+            chosen_key = self.rng.choice(best_keys)
             return chosen_key
 
 
-    def value_fun(self, s_t, t, gamma):
-        # computes the value function recursively based on the current policy
-        # input: s_t (state), t (int), gamma (float); output: float
-        total_reward = 0
-        # if this recursion is either at a terminal state or at maximum depth: return without any reward
-        if s_t in self.env.state_is_terminal(s_t) or t >= self.T:
-            return total_reward
-        # for every action that is possible from this state
-        for a in self.policy[s_t].keys():
-            # get the probability of performing the action
-            action_prob = self.policy[s_t][a]
-            if action_prob: # > 0, otherwise no need to go deeper in the search tree here
-                action_reward = self.action_value_fun(s_t, a, t, gamma)
-                total_reward += action_reward * action_prob
-        # return the sum of the expected reward in this state given the policy
-        return total_reward
-
-
-    def action_value_fun(self, s_t, a, t, gamma):
-        # computes action-value function recursively using transitions
-        # input: s_t (state), a (action), t (int), gamma (float); output: float
-        state_transition_probs = self.env.get_possible_outcomes(s_t, a)
-        # the future possible rewards are computed recursively using the value function, that means
-        # any future decisions are made with the policy rather than a fixed function
-        total = 0
-        for s_t_1, prob in state_transition_probs.items():
-            # Get the immediate reward for transitioning from s_t to s_t_1 using action a
-            reward = self.env.get_reward(s_t, a, s_t_1)
-            # Recursively compute the estimated future value
-            future_value = gamma * self.value_fun(s_t_1, t + 1, gamma)
-            # Add the weighted value (probability × (reward + future value))
-            total += prob * (reward + future_value)
-        return total
-
     def action_value_fun_star(self, s, a, gamma, v):
         # computes optimal action-value given current value estimates v
         # input: s (state), a (action), gamma (float), v (dict); output: float
@@ -197,16 +196,101 @@ class Bot():
             print()
         return R, t, transitions
 
-    def make_test_runs(self, k=100, *args, **kwargs):
+    def make_test_runs(self, k=100, *args, n_workers=None, seed=None, **kwargs):
         # performs multiple test episodes and prints average results
-        # input: k (int), args/kwargs - additional params for episodes; output: none
+        # input: k (int), args/kwargs - additional params for episodes,
+        #        n_workers (int or None): run the episodes in that many processes (see rollouts),
+        #        seed (int or None): seed of the parallel rollouts; output: none
         print(f"Performing {k} test runs ...")
-        results = [self.episode(*args, **kwargs) for _ in range(k)]
-        print("Best reward:", np.max([x[0] for x in results]))
-        print("Mean reward:", np.mean([x[0] for x in results]))
-        print("Mean time-step of termination:", np.mean([x[1] for x in results]))
+        # positional args are the first params of episode, as keywords they also reach the parallel rollouts
+        kwargs = dict(zip(("policy", "epsilon", "verbose"), args), **kwargs)
+        if n_workers is not None and n_workers > 1:
+            rewards, lengths, _ = self.rollouts(k, n_workers=n_workers, seed=seed, **kwargs)
+        else:
+            results = [self.episode(**kwargs) for _ in range(k)]
+            rewards, lengths = [x[0] for x in results], [x[1] for x in results]
+        print("Best reward:", np.max(rewards))
+        print("Mean reward:", np.mean(rewards))
+        print("Mean time-step of termination:", np.mean(lengths))
         print()
 
+    def rollout_pool(self, n_workers=None, policy=None):
+        # process pool for rollouts, the bot (environment and policy) is shipped to every worker once
+        # input: n_workers (int or None -> all cores),
+        #        policy (fixed policy the workers use instead of the bot's one, e.g. an off-policy behaviour policy,
+        #                also shipped once); output: ProcessPoolExecutor
+        return ProcessPoolExecutor(max_workers=n_workers or os.cpu_count(),
+                                   initializer=rollout_worker_init, initargs=(self, policy))
+
+    def policy_update(self, pool_size):
+        # what the workers of a rollout pool need to catch up with the bot's TabularPolicy: the states added
+        # since the pool was opened (when the policy had pool_size states) and the probability array,
+        # much less to pickle than the policy itself with its environment
+        # input: pool_size (int); output: (list of states, array (S, A))
+        return self.policy.states[pool_size:], self.policy.probs[:len(self.policy)]
+
+    def rollouts(self, k, n_workers=None, seed=None, return_transitions=False, pool=None, policy_update=None, **kwargs):
+        # performs k episodes split across worker processes
+        # every worker chunk gets its own random stream spawned from seed, so the results are reproducible
+        # for a given seed and number of workers
+        # input: k (int), n_workers (int or None -> all cores), seed (int, SeedSequence or None),
+        #        return_transitions (bool), pool (an open rollout_pool to reuse, otherwise one is opened and closed),
+        #        policy_update (see policy_update, applied to the workers' copy of the bot's policy before the episodes),
+        #        kwargs - additional params for the episodes (e.g. epsilon, policy)
+        # output: rewards (array (k,)), lengths (array (k,)), transitions (list of k lists, or None)
+        n_workers = n_workers or os.cpu_count()
+        seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        # one chunk per worker, so kwargs like the policy are also sent only once per worker
+        chunk_sizes = [k // n_workers + (1 if i < k % n_workers else 0) for i in range(n_workers)]
+        tasks = [(chunk_seed, size, return_transitions, policy_update, kwargs)
+                 for chunk_seed, size in zip(seed_sequence.spawn(n_workers), chunk_sizes) if size > 0]
+        if pool is None:
+            with self.rollout_pool(n_workers) as pool:
+                chunks = list(pool.map(rollout_worker, tasks))
+        else:
+            chunks = list(pool.map(rollout_worker, tasks))
+        rewards = np.concatenate([chunk[0] for chunk in chunks])
+        lengths = np.concatenate([chunk[1] for chunk in chunks])
+        transitions = [t for chunk in chunks for t in chunk[2]] if return_transitions else None
+        return rewards, lengths, transitions
+
+
+# the rollout workers keep their copy of the bot and the fixed policy in these globals, see Bot.rollout_pool
+# worker_rows maps the rows of the bot's TabularPolicy in the main process to the rows of the worker's copy
+worker_bot, worker_policy, worker_rows = None, None, []
+
+def rollout_worker_init(bot, policy=None):
+    # initializer of the rollout worker processes, receives the bot (and a fixed policy) once per worker
+    global worker_bot, worker_policy, worker_rows
+    worker_bot, worker_policy = bot, policy
+    worker_rows = list(range(len(bot.policy))) if isinstance(bot.policy, TabularPolicy) else []
+
+def apply_policy_update(policy_update):
+    # brings the worker's copy of the bot's policy up to date, see Bot.policy_update
+    # the worker's copy may have added rows of its own, so states are mapped to rows by lookup
+    added_states, probs = policy_update
+    pool_size = len(probs) - len(added_states)
+    for s in added_states[len(worker_rows) - pool_size:]:
+        worker_rows.append(worker_bot.policy.index(s))
+    worker_bot.policy.set_rows(np.array(worker_rows[:len(probs)], dtype=np.int64), probs)
+
+def rollout_worker(task):
+    # performs one chunk of episodes with its own random streams, spawned from the chunk's seed
+    # input: task (seed_sequence, k, return_transitions, policy_update, episode kwargs)
+    # output: rewards (array), lengths (array), list of transitions (empty if not requested)
+    seed_sequence, k, return_transitions, policy_update, kwargs = task
+    worker_bot.seed(seed_sequence)
+    if policy_update is not None:
+        apply_policy_update(policy_update)
+    if worker_policy is not None and "policy" not in kwargs:
+        kwargs = dict(kwargs, policy=worker_policy)
+    rewards, lengths, transitions = np.zeros(k), np.zeros(k, dtype=np.int64), []
+    for i in range(k):
+        rewards[i], lengths[i], episode_transitions = worker_bot.episode(**kwargs)
+        if return_transitions: transitions.append(episode_transitions)
+    return rewards, lengths, transitions
+
+
 if __name__ == "__main__":
     env = BlackJack()
     env.set_start()
@@ -1,3 +1,5 @@
+import numpy as np
+
 from GridWorld import GridWorld
 
 class CliffWalking(GridWorld):
@@ -13,6 +15,9 @@ class CliffWalking(GridWorld):
         # Output: None
         super().__init__(h, w, terminal_states, starting_state)
         self.cliffs = cliffs
+        # constant time lookups of the cliff cells, see GridWorld.terminal_set
+        self.cliff_set = frozenset(cliffs)
+        self.cliff_mask = self.cell_mask(cliffs)
         # put all cliff cells into the grid for visuals
         self.put_onto_grid({pos: "X" for pos in self.cliffs})
         self.penalty = penalty
@@ -30,11 +35,27 @@ class CliffWalking(GridWorld):
             # ...stay
             new_state = state
         # if you're stepping onto a cliff cell
-        elif new_state in self.cliffs:
+        elif new_state in self.cliff_set:
             pass
             new_state = self.starting_state
         return new_state
 
+    def apply_action_batch(self, states, actions, rng):
+        # Vectorized apply_action: stepping onto a cliff cell sends the agent back to the start.
+        # Inputs:
+        #   states (int array): Current cell indices
+        #   actions (int array): Indices into self.actions
+        #   rng: Random generator (unused, the cliffs are deterministic)
+        # Output:
+        #   int array: Resulting cell indices
+        new_states = self.move_batch(states, actions)
+        fell = self.cliff_mask[new_states]
+        return np.where(fell, self.encode_state(self.starting_state), new_states)
+
+    def get_reward_batch(self, states, actions, next_states):
+        # Vectorized get_reward: the penalty for landing on the start, -1 otherwise.
+        return np.where(next_states == self.encode_state(self.starting_state), self.penalty, -1)
+
     def get_reward(self, state, action, new_state=None):
         # Computes reward for transitioning to new state; severe penalty for stepping onto cliff.
         # Inputs:
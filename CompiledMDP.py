@@ -0,0 +1,183 @@
+# ===================================================
+# Author: Nikolaus Czernin
+# Script: Compiled Markov Decision Process
+# Description: Enumerates the states of an Environment once and stores its dynamics
+#              as NumPy arrays (integer state index, P[s, a, s'], R[s, a, s'], terminal mask),
+#              so planners can work on arrays instead of calling the environment per transition.
+# ===================================================
+
+import numpy as np
+
+# scipy is optional, it is only needed for the sparse tensors of big environments
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+
+class CompiledMDP():
+    # above this number of entries in P (S * A * S) the tensors are stored sparse
+    dense_limit = 2 ** 22
+
+    def __init__(self, env, dense=None):
+        # enumerates all states of env once and builds the transition and reward tensors
+        # input: env (Environment), dense (bool or None, None decides by the size of the state space)
+        # output: none
+        self.env = env
+        self.actions = list(env.actions)
+        self.action_index = {a: i for i, a in enumerate(self.actions)}
+        # integer state index: states[i] is the state with index i
+        self.states = []
+        self.state_index = {}
+        for s in env.state_generator():
+            self.add_state(s)
+        # the states from the state_generator come first, the rest was only discovered as an outcome
+        self.num_enumerated = len(self.states)
+
+        # every transition is one entry in these flat lists:
+        # row = s * A + a, col = s', prob = P[s, a, s'], reward = R[s, a, s']
+        rows, cols, probs, rewards = [], [], [], []
+        terminal, legal = [], []
+        i = 0
+        # the state list grows while we walk it, if outcomes lead to states the generator did not yield
+        while i < len(self.states):
+            s = self.states[i]
+            is_terminal = bool(env.state_is_terminal(s))
+            terminal.append(is_terminal)
+            legal.append([False] * len(self.actions))
+            # terminal states do not transition anywhere, their value is always zero
+            if not is_terminal:
+                legal[i] = list(env.legal_mask(s))
+                for j, a in enumerate(self.actions):
+                    if not legal[i][j]:
+                        continue
+                    for s_t_1, prob in env.get_possible_outcomes(s, a).items():
+                        if not prob: continue
+                        rows.append(i * len(self.actions) + j)
+                        cols.append(self.add_state(s_t_1))
+                        probs.append(prob)
+                        rewards.append(env.get_reward(s, a, s_t_1))
+            i += 1
+
+        self.S = len(self.states)
+        self.A = len(self.actions)
+        self.terminal = np.array(terminal, dtype=bool)
+        self.legal = np.array(legal, dtype=bool).reshape(self.S, self.A)
+        # sort the transitions by (s, a), so the transitions of each pair are one contiguous slice
+        order = np.argsort(np.array(rows, dtype=np.int64), kind="stable")
+        self.rows = np.array(rows, dtype=np.int64)[order]
+        self.cols = np.array(cols, dtype=np.int64)[order]
+        self.probs = np.array(probs, dtype=np.float64)[order]
+        self.rewards = np.array(rewards, dtype=np.float64)[order]
+        # transitions of pair (s, a) are rows[indptr[s*A+a]:indptr[s*A+a+1]]
+        self.indptr = np.searchsorted(self.rows, np.arange(self.S * self.A + 1))
+        # expected immediate reward r[s, a] = sum_s' P[s, a, s'] * R[s, a, s']
+        self.r = np.bincount(self.rows, weights=self.probs * self.rewards,
+                             minlength=self.S * self.A).reshape(self.S, self.A)
+
+        if dense is None:
+            dense = self.S * self.A * self.S <= CompiledMDP.dense_limit
+        self.dense = dense
+        # P and R as flat (S*A, S) sparse matrices, used for the batched backups
+        self.P_flat, self.R_flat = None, None
+        if sparse is not None:
+            self.P_flat = sparse.csr_matrix((self.probs, (self.rows, self.cols)), shape=(self.S * self.A, self.S))
+            self.R_flat = sparse.csr_matrix((self.rewards, (self.rows, self.cols)), shape=(self.S * self.A, self.S))
+        if dense:
+            # P[s, a, s'] and R[s, a, s'] as dense (S, A, S) arrays
+            self.P = np.zeros((self.S * self.A, self.S))
+            self.R = np.zeros((self.S * self.A, self.S))
+            np.add.at(self.P, (self.rows, self.cols), self.probs)
+            self.R[self.rows, self.cols] = self.rewards
+            self.P = self.P.reshape(self.S, self.A, self.S)
+            self.R = self.R.reshape(self.S, self.A, self.S)
+        else:
+            # too big for dense arrays: P[s, a, s'] is row s * A + a of the sparse matrix
+            # without scipy only the flat transition arrays are available
+            self.P, self.R = self.P_flat, self.R_flat
+
+    def add_state(self, s):
+        # adds a state to the index if it is not in there yet
+        # input: s (state); output: int (index of s)
+        if s not in self.state_index:
+            self.state_index[s] = len(self.states)
+            self.states.append(s)
+        return self.state_index[s]
+
+    def expected_next_value(self, v):
+        # computes sum_s' P[s, a, s'] * v[s'] for every state-action pair at once
+        # input: v (array of shape (S,)); output: array of shape (S, A)
+        if self.P_flat is not None:
+            return (self.P_flat @ v).reshape(self.S, self.A)
+        return np.bincount(self.rows, weights=self.probs * v[self.cols],
+                           minlength=self.S * self.A).reshape(self.S, self.A)
+
+    def q_values(self, v, gamma):
+        # one batched Bellman backup: q[s, a] = sum_s' P[s, a, s'] * (R[s, a, s'] + gamma * v[s'])
+        # terminal next states contribute no future value, illegal actions get -inf
+        # input: v (array of shape (S,)), gamma (float); output: array of shape (S, A)
+        v = np.where(self.terminal, 0, v)
+        q = self.r + gamma * self.expected_next_value(v)
+        return np.where(self.legal, q, -np.inf)
+
+    def greedy_actions(self, q):
+        # picks the index of the best legal action for every state, ties go to the first action
+        # input: q (array of shape (S, A)); output: int array of shape (S,)
+        return np.argmax(np.where(self.legal, q, -np.inf), axis=1)
+
+    def policy_matrix(self, pi):
+        # builds the state-to-state transition matrix and expected reward vector of a policy
+        #   P_pi[s, s'] = sum_a pi(a|s) * P[s, a, s'],  r_pi[s] = sum_a pi(a|s) * r[s, a]
+        # input: pi (array (S, A)); output: P_pi (sparse (S, S) if scipy is available, else dense), r_pi (array (S,))
+        pi = np.where(self.legal, pi, 0)
+        weights = self.probs * pi.ravel()[self.rows]
+        from_states = self.rows // self.A
+        if sparse is not None:
+            # duplicate (s, s') entries get summed up by the csr constructor
+            P_pi = sparse.csr_matrix((weights, (from_states, self.cols)), shape=(self.S, self.S))
+        else:
+            P_pi = np.zeros((self.S, self.S))
+            np.add.at(P_pi, (from_states, self.cols), weights)
+        return P_pi, (pi * self.r).sum(axis=1)
+
+    def state_backup(self, i, v, gamma):
+        # Bellman optimality backup of a single state: max_a sum_s' P[i, a, s'] * (R[i, a, s'] + gamma * v[s'])
+        # the values of terminal states in v are expected to be 0
+        # input: i (int, state index), v (array (S,)), gamma (float); output: float
+        best = -np.inf
+        for j in range(self.A):
+            if not self.legal[i, j]: continue
+            lo, hi = self.indptr[i * self.A + j], self.indptr[i * self.A + j + 1]
+            best = max(best, self.r[i, j] + gamma * np.dot(self.probs[lo:hi], v[self.cols[lo:hi]]))
+        return best
+
+    def predecessors(self):
+        # index of all states s that can lead to s' with some action, built once and cached
+        # output: indptr (array (S+1,)), states (array), the predecessors of s' are states[indptr[s']:indptr[s'+1]]
+        if not hasattr(self, "predecessor_indptr"):
+            pairs = np.unique(self.cols * self.S + self.rows // self.A)
+            self.predecessor_states = pairs % self.S
+            self.predecessor_indptr = np.searchsorted(pairs // self.S, np.arange(self.S + 1))
+        return self.predecessor_indptr, self.predecessor_states
+
+    def v_array(self, v: dict, default_value=0):
+        # turns a value dict {state: value} into an array over the state index
+        return np.array([v.get(s, default_value) for s in self.states], dtype=np.float64)
+
+    def v_dict(self, v, all_states=False):
+        # turns an array over the state index back into a value dict {state: value}
+        # only the states of the state_generator are included, unless all_states is set
+        n = self.S if all_states else self.num_enumerated
+        return {self.states[i]: float(v[i]) for i in range(n)}
+
+    def policy_array(self, policy: dict):
+        # turns a policy dict {state: {action: prob}} into an (S, A) probability array
+        pi = np.zeros((self.S, self.A))
+        for s, i in self.state_index.items():
+            if s in policy:
+                for a, prob in policy[s].items():
+                    pi[i, self.action_index[a]] = prob
+        return pi
+
+    def __str__(self):
+        return f"CompiledMDP(S={self.S}, A={self.A}, transitions={len(self.rows)}, dense={self.dense})"
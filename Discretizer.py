@@ -0,0 +1,215 @@
+# ===================================================
+# Author: Nikolaus Czernin
+# Script: State discretization and tile coding
+# Description: Maps continuous states (e.g. the float tuples of the AutoregressiveTrendProcess)
+#              to compact integer indices with precomputed bin edges, so tabular learners
+#              see a bounded number of states and table lookups stay cheap.
+#              Discretizer: one grid over the features -> a single state index.
+#              TileCoder: several offset grids -> one active tile per grid (features for linear approximation).
+#              DiscretizedEnvironment: wraps any Environment, its states are the indices of a Discretizer.
+# ===================================================
+
+import numpy as np
+
+from Environment import Environment
+from Policy import TabularPolicy
+
+
+def row_major_strides(shape):
+    # strides that turn a multi-index into a flat index: index = sum_d i_d * strides[d]
+    return np.concatenate((np.cumprod(shape[::-1])[::-1][1:], [1])).astype(np.int64)
+
+
+class Discretizer():
+    def __init__(self, edges, features=None):
+        # input: edges (list with one sorted array of bin edges per feature, n edges make n+1 bins,
+        #               values below the first edge go into bin 0, values above the last one into the last bin),
+        #        features (callable state -> sequence of floats, or None to use the state itself)
+        self.edges = [np.asarray(e, dtype=np.float64) for e in edges]
+        self.features = features
+        self.bins = np.array([len(e) + 1 for e in self.edges], dtype=np.int64)
+        self.strides = row_major_strides(self.bins)
+        # number of distinct indices
+        self.n_states = int(np.prod(self.bins))
+
+    @classmethod
+    def uniform(cls, low, high, n_bins, features=None):
+        # equally wide bins between low and high for every feature
+        # input: low, high (sequences of floats), n_bins (int or sequence of ints), features (see __init__)
+        n_bins = np.broadcast_to(n_bins, (len(low),))
+        edges = [np.linspace(l, h, n + 1)[1:-1] for l, h, n in zip(low, high, n_bins)]
+        return cls(edges, features)
+
+    def feature_vector(self, state):
+        # the features of a state as a float array
+        return np.asarray(state if self.features is None else self.features(state), dtype=np.float64)
+
+    def bin_indices(self, x):
+        # bin of every feature; input: x (array (D,) or (N, D)); output: int array of the same shape
+        x = np.asarray(x, dtype=np.float64)
+        return np.stack([np.searchsorted(e, x[..., d], side="right") for d, e in enumerate(self.edges)], axis=-1)
+
+    def index(self, state):
+        # the integer index of a state; input: state; output: int in [0, n_states)
+        return int(self.bin_indices(self.feature_vector(state)) @ self.strides)
+
+    def index_batch(self, x):
+        # the integer indices of many feature vectors at once; input: x (array (N, D)); output: int array (N,)
+        return self.bin_indices(x) @ self.strides
+
+
+class TileCoder():
+    def __init__(self, low, high, n_tiles, n_tilings=8, features=None):
+        # n_tilings grids over [low, high] with n_tiles tiles per feature,
+        # each grid is shifted by a different fraction of a tile width (asymmetric offsets, Sutton & Barto 9.5.4)
+        # input: low, high (sequences of floats), n_tiles (int or sequence of ints), n_tilings (int),
+        #        features (callable state -> sequence of floats, or None to use the state itself)
+        self.low = np.asarray(low, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        n_tiles = np.broadcast_to(n_tiles, self.low.shape).astype(np.int64)
+        self.width = (self.high - self.low) / n_tiles
+        self.n_tilings = n_tilings
+        self.features = features
+        displacement = 2 * np.arange(len(self.low)) + 1
+        self.offsets = (np.arange(n_tilings)[:, None] * displacement / n_tilings % 1) * self.width
+        # one extra tile per feature, so every shifted grid still covers [low, high]
+        self.tiles = n_tiles + 1
+        self.strides = row_major_strides(self.tiles)
+        self.tiles_per_tiling = int(np.prod(self.tiles))
+        # length of the binary feature vector
+        self.n_features = n_tilings * self.tiles_per_tiling
+
+    def feature_vector(self, state):
+        # the features of a state as a float array
+        return np.asarray(state if self.features is None else self.features(state), dtype=np.float64)
+
+    def active_tiles_batch(self, x):
+        # the active tile of every tiling for many feature vectors
+        # input: x (array (N, D)); output: int array (N, n_tilings), indices in [0, n_features)
+        x = np.asarray(x, dtype=np.float64)
+        coords = np.floor((x[:, None, :] - self.low + self.offsets) / self.width).astype(np.int64)
+        coords = np.clip(coords, 0, self.tiles - 1)
+        return np.arange(self.n_tilings) * self.tiles_per_tiling + coords @ self.strides
+
+    def active_tiles(self, state):
+        # the active tile of every tiling; input: state; output: int array (n_tilings,)
+        return self.active_tiles_batch(self.feature_vector(state)[None])[0]
+
+
+class DiscreteState(int):
+    # integer state index that keeps the raw state of the wrapped environment it was computed from
+    # it hashes and compares like the int, so all raw states in one bin share their entries in tables
+    def __new__(cls, index, raw):
+        state = super().__new__(cls, index)
+        state.raw = raw
+        return state
+
+    def __getnewargs__(self):
+        # needed to pickle it, e.g. for Bot.rollouts
+        return int(self), self.raw
+
+
+class DiscretizedEnvironment(Environment):
+    # wraps an Environment, the states of the wrapper are the integer indices of a discretizer
+    # the wrapped environment still runs on its raw states, which travel along with the indices (DiscreteState)
+    def __init__(self, env, discretizer):
+        # input: env (Environment), discretizer (Discretizer or anything with index(state) and n_states)
+        self.env = env
+        self.discretizer = discretizer
+        self.n_states = discretizer.n_states
+        super().__init__(env.actions)
+        # the randomness happens in the wrapped environment, so both share its stream
+        self.rng = env.rng
+        if env.starting_state is not None:
+            self.starting_state = self.encode(env.starting_state)
+
+    def seed(self, seed=None):
+        # seeds the wrapped environment, see Environment.seed
+        self.env.seed(seed)
+        self.rng = self.env.rng
+
+    def encode(self, raw_state):
+        # raw state of the wrapped environment -> DiscreteState
+        if raw_state is None: return None
+        return DiscreteState(self.discretizer.index(raw_state), raw_state)
+
+    def set_start(self, starting_state=None):
+        # sets the starting state of the wrapped environment, starting_state is a raw or discrete state
+        if starting_state is None:
+            self.env.set_start()
+        else:
+            self.env.set_start(getattr(starting_state, "raw", starting_state))
+        self.starting_state = self.encode(self.env.starting_state)
+
+    def reset(self):
+        self.env.reset()
+        self.starting_state = self.encode(self.env.starting_state)
+
+    def state_generator(self):
+        # all state indices, so tables over the discretized states have a fixed size
+        yield from range(self.n_states)
+
+    def encode_state(self, state):
+        # the states already are compact ints
+        return int(state)
+
+    def decode_state(self, i):
+        # the bin index, the raw state can not be recovered from it
+        return int(i)
+
+    def state_is_terminal(self, state) -> bool:
+        # plain indices (e.g. from the state_generator) stand for a whole bin and are never terminal
+        return hasattr(state, "raw") and self.env.state_is_terminal(state.raw)
+
+    def is_this_action_possible(self, state, action) -> bool:
+        if not hasattr(state, "raw"):
+            return action in self.actions
+        return self.env.is_this_action_possible(state.raw, action)
+
+    def legal_entry(self, state):
+        # the states of one bin can differ in their legal actions, so the wrapped environment caches them by raw state
+        if not hasattr(state, "raw"):
+            return self.all_legal
+        return self.env.legal_entry(state.raw)
+
+    def apply_action(self, state, action):
+        return self.encode(self.env.apply_action(state.raw, action))
+
+    def get_possible_outcomes(self, state, action):
+        # the outcome is sampled in the wrapped environment, different raw outcomes can fall into the same bin
+        # so the probabilities over bins are not tracked: the sampled outcome is returned with probability 1
+        if action is None:
+            return
+        outcomes = self.env.get_possible_outcomes(state.raw, action)
+        return {self.encode(self.env.resolve_outcome(outcomes)): 1}
+
+    def get_reward(self, state, action, new_state=None):
+        return self.env.get_reward(state.raw, action, getattr(new_state, "raw", new_state))
+
+    def vectorized_policy(self, policy, epsilon=-1, rng=None):
+        # turns a policy over the state indices into a function for batches of raw states
+        # (e.g. for AutoregressiveTrendProcess.simulate_batch)
+        # a TabularPolicy (e.g. Bot.policy) is sampled epsilon-greedily for all states at once (TabularPolicy.sample_actions),
+        # for other policies the most probable action of each bin is picked
+        # the discretizer features have to accept an (M, D) array of raw states
+        # input: policy (dict-like {index: {action: prob}}), epsilon (float),
+        #        rng (numpy Generator, RandomStream or None for the environment's own stream)
+        # output: callable raw states (M, D) -> actions (M,)
+        actions = np.array(self.actions)
+        if isinstance(policy, TabularPolicy):
+            rng = self.rng if rng is None else rng
+            # policy row of every bin, bins the policy does not know yet get an equiprobable row
+            rows = np.array([policy.index(i) for i in range(self.n_states)], dtype=np.int64)
+            policy_actions = np.array(policy.actions)
+            def act(raw_states):
+                bins = self.discretizer.index_batch(self.discretizer.feature_vector(raw_states))
+                return policy_actions[policy.sample_actions(rows[bins], epsilon, rng)]
+            return act
+        table = np.array([self.actions.index(max(policy[i], key=policy[i].get)) if i in policy else 0
+                          for i in range(self.n_states)])
+        def act(raw_states):
+            return actions[table[self.discretizer.index_batch(self.discretizer.feature_vector(raw_states))]]
+        return act
+
+    def __str__(self):
+        return f"DiscretizedEnvironment({type(self.env).__name__}, {self.n_states} states)"
@@ -0,0 +1,79 @@
+# ===================================================
+# Author: Nikolaus Czernin
+# Script: Eligibility traces
+# Description: Traces e(s, a) over the entries of a QTable for TD(lambda) learners (see TemporalDifference.py).
+#              DenseTraces keep an (S, A) array next to the table, every step costs O(S*A) vectorized work.
+#              SparseTraces only store the non-zero traces, every step costs O(number of active traces).
+#              Both drop traces that decayed below a cutoff, so old visits stop costing anything.
+# ===================================================
+
+import numpy as np
+
+
+class DenseTraces():
+    # traces as an extra array of the QTable (Q.extras["traces"]), so they grow and get evicted together with Q
+    def __init__(self, Q, cutoff=1e-4, replacing=True):
+        # input: Q (QTable), cutoff (float, traces below it are set to 0),
+        #        replacing (bool, a visit sets the trace to 1 instead of adding 1)
+        self.Q = Q
+        self.cutoff = cutoff
+        self.replacing = replacing
+        Q.extras["traces"] = np.zeros_like(Q.data)
+
+    def visit(self, i, j):
+        # marks entry (i, j) of Q as just visited
+        E = self.Q.extras["traces"]
+        E[i, j] = 1 if self.replacing else E[i, j] + 1
+
+    def update(self, delta, alpha):
+        # Q += alpha * delta * e for all entries
+        Q, n = self.Q, len(self.Q)
+        E = Q.extras["traces"][:n]
+        Q.data[:n] += alpha * delta * E
+        # only the rows with a trace changed, their greedy actions are recomputed
+        rows = np.flatnonzero(E.any(axis=1))
+        Q.best[rows] = np.argmax(Q.data[rows], axis=1)
+
+    def decay(self, factor):
+        # e *= factor, traces below the cutoff are dropped
+        E = self.Q.extras["traces"]
+        E *= factor
+        E[np.abs(E) < self.cutoff] = 0
+
+    def clear(self):
+        self.Q.extras["traces"][:] = 0
+
+    def __len__(self):
+        # number of active traces
+        return int(np.count_nonzero(self.Q.extras["traces"]))
+
+
+class SparseTraces():
+    # traces as a dict {(i, j): e} of the non-zero entries
+    # the keys are row indices of Q, so with an LRU capacity on Q use DenseTraces, which are reset on eviction
+    def __init__(self, Q, cutoff=1e-4, replacing=True):
+        # input: see DenseTraces
+        self.Q = Q
+        self.cutoff = cutoff
+        self.replacing = replacing
+        self.traces = {}
+
+    def visit(self, i, j):
+        # marks entry (i, j) of Q as just visited
+        self.traces[(i, j)] = 1 if self.replacing else self.traces.get((i, j), 0) + 1
+
+    def update(self, delta, alpha):
+        # Q += alpha * delta * e for the active traces
+        for (i, j), e in self.traces.items():
+            self.Q.set_by_index(i, j, self.Q.data[i, j] + alpha * delta * e)
+
+    def decay(self, factor):
+        # e *= factor, traces below the cutoff are dropped
+        self.traces = {key: e * factor for key, e in self.traces.items() if abs(e * factor) >= self.cutoff}
+
+    def clear(self):
+        self.traces = {}
+
+    def __len__(self):
+        # number of active traces
+        return len(self.traces)
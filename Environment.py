@@ -3,8 +3,11 @@
 # reward computation, and simulation utilities for both discrete domains
 # Note to self: look into continuous states
 
+from itertools import accumulate
 from pprint import pprint
-import random
+
+from CompiledMDP import CompiledMDP
+from RandomStream import RandomStream
 
 class Environment():
     def __init__(self, actions):
@@ -13,6 +16,23 @@ class Environment():
         self.rewards = {a: 0 for a in self.actions}
         self.starting_state = None
         self.terminal_states = []
+        # cached array version of the dynamics, see compile()
+        self.compiled = None
+        # integer codes of the states, see encode_state
+        self.state_codes = None
+        self.coded_states = []
+        # cache of the legal actions per state, see legal_actions
+        self.legal_cache = {}
+        # environments that do not override is_this_action_possible allow every action in every state
+        self.all_legal = (list(self.actions), (True,) * len(self.actions))
+        self.legal_everywhere = type(self).is_this_action_possible is Environment.is_this_action_possible
+        # own random stream of the environment, see seed
+        self.rng = RandomStream()
+
+    def seed(self, seed=None):
+        # Replaces the random stream of the environment by a seeded one
+        # input: seed (int, SeedSequence or None); output: none
+        self.rng = RandomStream(seed)
 
     def set_start(self, starting_state=None):
         # Set the initial state of the environment
@@ -43,15 +63,14 @@ class Environment():
         # output: bool
         raise NotImplementedError()
 
-    @staticmethod
-    def get_random_state(states, states_to_avoid=None):
-        # Returns a random state, avoiding specific ones if needed
+    def get_random_state(self, states, states_to_avoid=None):
+        # Returns a random state, avoiding specific ones if needed, drawn from the environment's stream
         # input: states - list, states_to_avoid - list or None
         # output: single state
-        s = random.choice(states)
+        s = self.rng.choice(states)
         if states_to_avoid is not None:
             if s in states_to_avoid:
-                s = Environment.get_random_state(states, states_to_avoid)
+                s = self.get_random_state(states, states_to_avoid)
         return s
 
     def is_this_action_possible(self, state, action) -> bool:
@@ -60,6 +79,38 @@ class Environment():
         # output: bool
         return True if action in self.actions else False
 
+    def legal_actions_key(self, state):
+        # Key under which the legal actions of a state are cached, states with the same key have the same legal actions
+        # subclasses whose legality depends on only a part of the state can return that part to share cache entries
+        # input: state; output: hashable
+        return state
+
+    def legal_entry(self, state):
+        # Legal actions and mask of a state, computed once per legal_actions_key and then cached
+        # input: state; output: (list of actions, tuple of bools)
+        if self.legal_everywhere:
+            return self.all_legal
+        key = self.legal_actions_key(state)
+        entry = self.legal_cache.get(key)
+        if entry is None:
+            mask = tuple(bool(self.is_this_action_possible(state, a)) for a in self.actions)
+            entry = self.legal_cache[key] = ([a for a, legal in zip(self.actions, mask) if legal], mask)
+        return entry
+
+    def legal_actions(self, state):
+        # The possible actions in state, in the order of self.actions (cached, the list must not be modified)
+        # input: state; output: list of actions
+        return self.legal_entry(state)[0]
+
+    def legal_mask(self, state):
+        # Same as legal_actions as one bool per action of self.actions
+        # input: state; output: tuple of bools
+        return self.legal_entry(state)[1]
+
+    def invalidate_legal_actions(self):
+        # Drops the cached legal actions, call it after changing anything is_this_action_possible depends on
+        self.legal_cache = {}
+
     def apply_action(self, state, action):
         # Computes next state from applying action in current state
         # input: state, action
@@ -76,7 +127,41 @@ class Environment():
 
     def resolve_outcome(self, outcomes:dict):
         # from all possible outcomes (keys) pick one with the given probabilities (values)
-        return random.choices(
-            population=list(outcomes.keys()),
-            weights=list(outcomes.values())
-        )[0]
\ No newline at end of file
+        # deterministic transitions do not need a random number
+        if len(outcomes) == 1:
+            return next(iter(outcomes))
+        return self.rng.weighted_choice(list(outcomes.keys()), list(accumulate(outcomes.values())))
+
+    def encode_state(self, state):
+        # Maps a state to a compact int, by default its position in state_generator()
+        # states the generator does not yield (or all states, if it is not implemented)
+        # get the next free code when they are encoded for the first time
+        # subclasses with a natural numbering override this together with decode_state
+        # input: state; output: int
+        if self.state_codes is None:
+            self.state_codes = {}
+            try:
+                for s in self.state_generator():
+                    if s not in self.state_codes:
+                        self.state_codes[s] = len(self.coded_states)
+                        self.coded_states.append(s)
+            except NotImplementedError:
+                pass
+        code = self.state_codes.get(state)
+        if code is None:
+            code = self.state_codes[state] = len(self.coded_states)
+            self.coded_states.append(state)
+        return code
+
+    def decode_state(self, i):
+        # Inverse of encode_state; input: int; output: state
+        return self.coded_states[i]
+
+    def compile(self, recompile=False, dense=None):
+        # Enumerates state_generator() once and stores the dynamics as arrays (see CompiledMDP.py)
+        # the result is cached, pass recompile=True after changing the environment
+        # input: recompile (bool), dense (bool or None); output: CompiledMDP
+        if self.compiled is None or recompile:
+            if recompile: self.invalidate_legal_actions()
+            self.compiled = CompiledMDP(self, dense=dense)
+        return self.compiled
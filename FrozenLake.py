@@ -1,3 +1,5 @@
+import numpy as np
+
 from GridWorld import GridWorld
 
 class FrozenLake(GridWorld):
@@ -17,6 +19,9 @@ class FrozenLake(GridWorld):
         self.slippery = slippery
         terminal_states = holes + goals
         super().__init__(h, w, terminal_states, starting_state)
+        # constant time lookups of the goals, see GridWorld.terminal_set (which already covers the holes)
+        self.goal_set = frozenset(goals)
+        self.goal_mask = self.cell_mask(goals)
         # put all cliff cells into the grid for visuals
         self.put_onto_grid({pos: "H" for pos in self.holes})
 
@@ -29,7 +34,7 @@ class FrozenLake(GridWorld):
         # Output:
         #   int: reward (1 if goal reached, else 0)
         # when you reach a goal, get a reward of 1
-        if new_state in self.goals:
+        if new_state in self.goal_set:
             return 1
         # otherwise the reward is zero
         return 0
@@ -44,7 +49,8 @@ class FrozenLake(GridWorld):
         if not self.slippery:
             return super().apply_action(state, action)
         else:
-            pass
+            # sample where the agent slips to
+            return self.resolve_outcome(self.get_possible_outcomes(state, action))
 
     def get_possible_outcomes(self, state:tuple, action:tuple):
         # Computes possible state outcomes and their probabilities from a state-action pair.
@@ -63,8 +69,29 @@ class FrozenLake(GridWorld):
             # that means if you have direction of index i,
             # then turning left is the direction of index i - 1
             # and turning right is the direction of index i - 3
-            return {
-                super().apply_action(state, action): 1/3,
-                super().apply_action(state, self.actions[self.actions.index(action) - 1]): 1/3,
-                super().apply_action(state, self.actions[self.actions.index(action) - 3]): 1/3
-            }
+            # several directions can end up in the same state (e.g. at a wall), so sum up their probabilities
+            outcomes = {}
+            i = self.actions.index(action)
+            for direction in (action, self.actions[i - 1], self.actions[i - 3]):
+                new_state = super().apply_action(state, direction)
+                outcomes[new_state] = outcomes.get(new_state, 0) + 1/3
+            return outcomes
+
+    def apply_action_batch(self, states, actions, rng):
+        # Vectorized apply_action: on a slippery lake every agent goes into the intended direction
+        # or slips to one of the perpendicular ones, with a probability of 1/3 each.
+        # Input:
+        #   states (int array): current cell indices
+        #   actions (int array): indices into self.actions
+        #   rng: random generator, draws the slips
+        # Output:
+        #   int array: resulting cell indices
+        if self.slippery:
+            # same indexing trick as in get_possible_outcomes: offsets 0, -1 and -3 of the action index
+            offsets = np.array([0, -1, -3])[(rng.random(len(actions)) * 3).astype(np.int64)]
+            actions = (actions + offsets) % len(self.actions)
+        return self.move_batch(states, actions)
+
+    def get_reward_batch(self, states, actions, next_states):
+        # Vectorized get_reward: 1 for reaching a goal, 0 otherwise.
+        return self.goal_mask[next_states].astype(np.int64)
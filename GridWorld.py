@@ -5,6 +5,8 @@
 #              including states, actions, terminal states, rewards, and grid visualization.
 # ===================================================
 
+import numpy as np
+
 from Grid import Grid
 
 from Environment import Environment
@@ -13,16 +15,16 @@ from Environment import Environment
 
 class GridWorld(Environment):
     action_mappings = { # (y, x)
-        "(1, 0)": "↓",
-        "(-1, 0)": "↑",
-        "(0, 1)": "→",
-        "(0, -1)": "←",
-        "(2, 0)": "↓↓",
-        "(-2, 0)": "↑↑",
-        "(0, 2)": "→→",
-        "(0, -2)": "←←",
-        "None": "o",
-        "(0, 0)": "o"
+        (1, 0): "↓",
+        (-1, 0): "↑",
+        (0, 1): "→",
+        (0, -1): "←",
+        (2, 0): "↓↓",
+        (-2, 0): "↑↑",
+        (0, 2): "→→",
+        (0, -2): "←←",
+        None: "o",
+        (0, 0): "o"
     }
 
     def __init__(self, h, w, terminal_states, starting_state):
@@ -41,6 +43,10 @@ class GridWorld(Environment):
         self.height = h
         self.width = w
         self.terminal_states = terminal_states
+        # constant time lookups of the terminal cells: a frozenset of (y, x) states
+        # and a boolean mask over the cell indices (for the batch functions)
+        self.terminal_set = frozenset(terminal_states)
+        self.terminal_mask = self.cell_mask(terminal_states)
         self.set_start(starting_state)
         # OPTIONAL
         # Grid is a clas that draws a pretty grid with whatever items you put on them
@@ -65,8 +71,7 @@ class GridWorld(Environment):
         # Checks if a state is terminal.
         # Input: state (tuple)
         # Output: bool (True if terminal, False otherwise)
-        if state in self.terminal_states:
-            return True
+        return state in self.terminal_set
 
     def put_onto_grid(self, position_value_mapping: dict):
         # Places specified values onto the visualization grid at given positions.
@@ -88,7 +93,7 @@ class GridWorld(Environment):
         # Input: state (tuple), action (tuple)
         # Output: bool
         # for terminal states, just return False
-        if state in self.terminal_states: return False
+        if state in self.terminal_set: return False
         return True
 
     def apply_action(self, state, action):
@@ -109,6 +114,68 @@ class GridWorld(Environment):
         new_state = self.apply_action(state, action)
         return {new_state: 1}
 
+    def encode_state(self, state):
+        # Maps a (y, x) state to its integer cell index y * width + x.
+        # Input: state (tuple)
+        # Output: int
+        return state[0] * self.width + state[1]
+
+    def decode_state(self, i):
+        # Maps an integer cell index back to its (y, x) state.
+        # Input: i (int)
+        # Output: tuple (y, x)
+        return int(i) // self.width, int(i) % self.width
+
+    def cell_mask(self, cells):
+        # Boolean array over the cell indices, True for the given cells.
+        # The masks of the special cells are built once at construction (e.g. self.terminal_mask).
+        # Input: cells (list of (y, x) tuples)
+        # Output: bool array of shape (height * width,)
+        mask = np.zeros(self.height * self.width, dtype=bool)
+        for cell in cells:
+            mask[self.encode_state(cell)] = True
+        return mask
+
+    def reset_batch(self, n):
+        # Starting states of n independent episodes for step_batch.
+        # Input: n (int)
+        # Output: int array of shape (n,) (cell indices)
+        return np.full(n, self.encode_state(self.starting_state), dtype=np.int64)
+
+    def step_batch(self, states, actions, rng=None):
+        # Advances N independent episodes by one step at once.
+        # Episodes that are already in a terminal state stay there, with a reward of 0.
+        # Input: states (int array (N,), cell indices), actions (int array (N,), indices into self.actions),
+        #        rng (numpy Generator, RandomStream or None for the environment's own stream, used for stochastic environments)
+        # Output: next_states (int array (N,)), rewards (float array (N,)), dones (bool array (N,))
+        states = np.asarray(states, dtype=np.int64)
+        actions = np.asarray(actions, dtype=np.int64)
+        terminal = self.terminal_mask
+        already_done = terminal[states]
+        next_states = self.apply_action_batch(states, actions, self.rng if rng is None else rng)
+        rewards = self.get_reward_batch(states, actions, next_states).astype(np.float64)
+        next_states = np.where(already_done, states, next_states)
+        rewards = np.where(already_done, 0, rewards)
+        return next_states, rewards, terminal[next_states]
+
+    def move_batch(self, states, actions):
+        # Vectorized version of GridWorld.apply_action: moves and stays in place when leaving the grid.
+        # Input: states (int array (N,)), actions (int array (N,))
+        # Output: int array (N,)
+        y, x = np.divmod(states, self.width)
+        directions = np.array(self.actions, dtype=np.int64)[actions]
+        new_y, new_x = y + directions[:, 0], x + directions[:, 1]
+        out_of_bounds = (new_y < 0) | (new_y >= self.height) | (new_x < 0) | (new_x >= self.width)
+        return np.where(out_of_bounds, states, new_y * self.width + new_x)
+
+    def apply_action_batch(self, states, actions, rng):
+        # Vectorized apply_action, see step_batch.
+        return self.move_batch(states, actions)
+
+    def get_reward_batch(self, states, actions, next_states):
+        # Vectorized get_reward, see step_batch: every step costs -1.
+        return np.full(len(states), -1)
+
     def get_reward(self, state: tuple, action: tuple, new_state: tuple = None):
         # Computes the reward obtained by transitioning from state to new_state using action.
         # Input: state (tuple), action (tuple), new_state (tuple, optional)
@@ -124,7 +191,7 @@ class GridWorld(Environment):
         # Converts an action tuple into a human-readable arrow representation.
         # Input: a (tuple)
         # Output: str (arrow representation)
-        return GridWorld.action_mappings[str(a)]
+        return GridWorld.action_mappings[a if a is None else tuple(a)]
 
     def __str__(self):
         # Returns the visual representation of the GridWorld.
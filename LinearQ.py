@@ -0,0 +1,110 @@
+# ===================================================
+# Author: Nikolaus Czernin
+# Script: Linear action-value function approximation
+# Description: q(s, a) = w_a . x(s) with a fixed-size weight matrix instead of a table over all states,
+#              for environments with huge or continuous state spaces.
+#              The feature vector x(s) comes from a pluggable feature extractor (anything with n_features,
+#              __call__(state) and batch(states)), e.g. TileFeatures or IndexFeatures below.
+#              LinearQ has the same greedy interface as QTable, so it works with GreedyPolicy and Bot.
+# ===================================================
+
+import numpy as np
+
+from QTable import QTable
+
+
+class IndexFeatures():
+    # one-hot features of an integer index of the state (e.g. GridWorld.encode_state or Discretizer.index)
+    # with these, linear approximation is the same as a table
+    def __init__(self, index, n_features):
+        # input: index (callable state -> int in [0, n_features)), n_features (int)
+        self.index = index
+        self.n_features = n_features
+
+    def __call__(self, state):
+        x = np.zeros(self.n_features)
+        x[self.index(state)] = 1
+        return x
+
+    def batch(self, states):
+        # feature matrix of many states; input: states (list); output: array (N, n_features)
+        X = np.zeros((len(states), self.n_features))
+        X[np.arange(len(states)), [self.index(s) for s in states]] = 1
+        return X
+
+
+class TileFeatures():
+    # binary features of a TileCoder (see Discretizer.py): one active tile per tiling, plus a constant bias feature
+    def __init__(self, tile_coder):
+        self.tile_coder = tile_coder
+        self.n_features = tile_coder.n_features + 1
+
+    def __call__(self, state):
+        x = np.zeros(self.n_features)
+        x[self.tile_coder.active_tiles(state)] = 1
+        x[-1] = 1
+        return x
+
+    def batch(self, states):
+        # feature matrix of many states; input: states (list); output: array (N, n_features)
+        tiles = self.tile_coder.active_tiles_batch(np.array([self.tile_coder.feature_vector(s) for s in states]))
+        X = np.zeros((len(states), self.n_features))
+        X[np.arange(len(states))[:, None], tiles] = 1
+        X[:, -1] = 1
+        return X
+
+
+class LinearQ():
+    def __init__(self, actions, features, initial_weight=0.0):
+        # input: actions (list), features (feature extractor, see above), initial_weight (float)
+        self.actions = list(actions)
+        self.action_index = {a: j for j, a in enumerate(self.actions)}
+        self.features = features
+        # one weight vector per action: q(s, a) = weights[a] . x(s)
+        self.weights = np.full((len(self.actions), features.n_features), initial_weight, dtype=np.float64)
+        # every state has action-values, there is no table to fill (see GreedyPolicy.__contains__)
+        self.lazy = True
+
+    def values(self, s, x=None):
+        # action-values of all actions in state s; input: s (state), x (feature vector of s, if known)
+        # output: array (A,)
+        return self.weights @ (self.features(s) if x is None else x)
+
+    def get(self, s, a):
+        # q(s, a); input: s (state), a (action); output: float
+        return self.weights[self.action_index[a]] @ self.features(s)
+
+    def greedy_action(self, s):
+        # action with the highest value in state s, ties go to the first action like in QTable
+        return self.actions[int(np.argmax(self.values(s)))]
+
+    def max_value(self, s):
+        # max_a q(s, a); input: s (state); output: float
+        return self.values(s).max()
+
+    def update(self, x, j, target, alpha):
+        # semi-gradient step of q(s, a_j) towards target, the gradient of w_j . x w.r.t. w_j is x
+        # input: x (feature vector of s), j (action index), target (float), alpha (float)
+        self.weights[j] += alpha * (target - self.weights[j] @ x) * x
+
+    def update_batch(self, X, J, targets, alpha):
+        # semi-gradient steps for a batch of samples at once, all errors are computed with the weights before the batch
+        # input: X (feature matrix (N, F)), J (action indices (N,)), targets (array (N,)), alpha (float)
+        errors = targets - np.einsum("nf,nf->n", self.weights[J], X)
+        np.add.at(self.weights, J, alpha * errors[:, None] * X)
+
+    def to_table(self, states):
+        # the action-values of some states as a QTable, e.g. for printing or drawing
+        Q = QTable(self.actions, states)
+        Q.table = self.features.batch(Q.states) @ self.weights.T
+        return Q
+
+    def __contains__(self, s):
+        return True
+
+    def keys(self):
+        # no states are stored
+        return []
+
+    def __repr__(self):
+        return f"LinearQ(actions={self.actions}, n_features={self.features.n_features})"
@@ -4,6 +4,18 @@
 # Description:
 # ===================================================
 
+import heapq
+import time
+import warnings
+
+import numpy as np
+# scipy is optional, without it the linear policy evaluation uses a dense solver
+try:
+    from scipy import sparse
+    from scipy.sparse import linalg as sparse_linalg
+except ImportError:
+    sparse = None
+
 from GridWorld import GridWorld
 from Bot import Bot
 from BlackJack import BlackJack
@@ -12,6 +24,8 @@ from WindyGridWorld import WindyGridWorld
 
 
 class MarkovDecisionProcess():
+    # statistics of the last planning run, e.g. {"sweeps": 12, "seconds": 0.01}
+    stats = {}
 
     @staticmethod
     def init_v(env, default_value=0):
@@ -19,58 +33,102 @@ class MarkovDecisionProcess():
 
     @staticmethod
     def iterative_policy_evaluation(bot, accuracy_thresh, gamma):
-        # initiate v: vector with the value q of the best possible action a in state s
-        # initial values are random, except for terminal states, for them pick 0
-        v = MarkovDecisionProcess.init_v(bot.env)
-        while True:
-            Delta = 0
-            for i, s in enumerate(bot.env.state_generator()):
-                # get the value w of the currently best action for state s
-                w = v[s]
-                # apply the Bellman function to iteratively find a better action's value
-                v[s] = bot.value_fun(s, 0, gamma)
-                # get your improvement
-                # if Delta >= abs(w - v[s]): print("picking new best function!")
-                Delta = max(Delta, abs(w - v[s]))
+        # evaluates the bot's current policy, see evaluate_policy
+        return MarkovDecisionProcess.evaluate_policy(bot, accuracy_thresh, gamma)
+
+    @staticmethod
+    def evaluate_policy(bot, accuracy_thresh, gamma, v=None, max_sweeps=None, method="sweep"):
+        # policy evaluation on the compiled tensors (see CompiledMDP.py)
+        # method "sweep": every sweep backs up all states from the current v table at once:
+        #   v[s] = sum_a pi(a|s) * sum_s' P[s, a, s'] * (R[s, a, s'] + gamma * v[s'])
+        # so one sweep costs O(number of transitions) instead of a recursion per state
+        # method "linear": solves (I - gamma * P_pi) v = r_pi directly, see policy_evaluation_linear
+        # input: bot (Bot), accuracy_thresh (float), gamma (float),
+        #        v (dict or None, the values to start from, None -> init_v),
+        #        max_sweeps (int or None -> bot.T, starting from zeros this gives the T-step values of the policy),
+        #        method (str)
+        # output: dict {state: value}
+        mdp = bot.env.compile()
+        if v is None: v = MarkovDecisionProcess.init_v(bot.env)
+        if max_sweeps is None: max_sweeps = bot.T
+        pi = mdp.policy_array(bot.policy)
+        if method == "linear":
+            v = MarkovDecisionProcess.policy_evaluation_linear(mdp, pi, gamma, accuracy_thresh, mdp.v_array(v), max_sweeps)
+        else:
+            v = MarkovDecisionProcess.policy_evaluation_sweeps(mdp, pi, gamma, accuracy_thresh, mdp.v_array(v), max_sweeps)
+        return mdp.v_dict(v)
+
+    @staticmethod
+    def policy_evaluation_linear(mdp, pi, gamma, accuracy_thresh, v, max_sweeps):
+        # exact policy evaluation: solves (I - gamma * P_pi) v = r_pi with scipy.sparse, or densely without scipy
+        # if the system is singular (gamma = 1 and a policy that never terminates from some state)
+        # it falls back to sweeps, starting from the given v (e.g. the previous policy's values)
+        # input: like policy_evaluation_sweeps; output: array (S,)
+        P_pi, r_pi = mdp.policy_matrix(pi)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            try:
+                if sparse is not None:
+                    A = sparse.identity(mdp.S, format="csc") - gamma * P_pi.tocsc()
+                    v_solved = sparse_linalg.spsolve(A, r_pi)
+                else:
+                    v_solved = np.linalg.solve(np.eye(mdp.S) - gamma * P_pi, r_pi)
+            except np.linalg.LinAlgError:
+                v_solved = None
+        if v_solved is not None and np.all(np.isfinite(v_solved)):
+            return v_solved
+        print("Singular policy system, falling back to policy evaluation sweeps")
+        return MarkovDecisionProcess.policy_evaluation_sweeps(mdp, pi, gamma, accuracy_thresh, v, max_sweeps)
+
+    @staticmethod
+    def policy_evaluation_sweeps(mdp, pi, gamma, accuracy_thresh, v, max_sweeps):
+        # synchronous policy evaluation sweeps on arrays
+        # input: mdp (CompiledMDP), pi (array (S, A)), gamma (float), accuracy_thresh (float),
+        #        v (array (S,)), max_sweeps (int); output: array (S,)
+        # only legal actions count, terminal states have no transitions and thus always a value of 0
+        pi = np.where(mdp.legal, pi, 0)
+        r_pi = (pi * mdp.r).sum(axis=1)
+        v = np.where(mdp.terminal, 0, v)
+        for j in range(max_sweeps):
+            v_new = r_pi + gamma * (pi * mdp.expected_next_value(v)).sum(axis=1)
+            Delta = np.max(np.abs(v_new - v), initial=0)
+            v = v_new
             if Delta < accuracy_thresh:
                 break
         return v
 
     @staticmethod
-    def policy_iteration(bot, accuracy_thresh, gamma):
+    def policy_iteration(bot, accuracy_thresh, gamma, evaluation="sweep"):
+        # evaluation: "sweep" or "linear", see evaluate_policy
         print("Policy Iteration")
+        start_time = time.perf_counter()
         # accuracy threshold. >0
+        mdp = bot.env.compile()
+        # initiate v: vector with the value q of the best possible action a in state s
+        # initial values are random, except for terminal states, for them pick 0
+        v = MarkovDecisionProcess.init_v(bot.env)
         # loop the whole thing until the policy is stable and thus doesn't get updated anymore
         j = 0
         while True:
             j += 1
             print("Iteration", j)
             # Policy Evaluation
-            # initiate v: vector with the value q of the best possible action a in state s
-            # initial values are random, except for terminal states, for them pick 0
-            v = MarkovDecisionProcess.init_v(bot.env)
-            while True:
-                Delta = 0
-                # for every possible state
-                for i, s in enumerate(bot.env.state_generator()):
-                    # if s in self.env.terminal_states: continue # no need to do anything with the terminal states
-                    w = v[s]
-                    v[s] = bot.value_fun(s, 0, gamma)
-                    Delta = max(Delta, abs(w - v[s]))
-                if Delta < accuracy_thresh:
-                    break
+            # warm-started from the values of the previous policy, which only changed in a few states
+            v = MarkovDecisionProcess.evaluate_policy(bot, accuracy_thresh, gamma, v=v, method=evaluation)
             # Policy Improvement
+            # pick the action that maximizes the action-value function, for all states at once
+            q = mdp.q_values(mdp.v_array(v), gamma)
+            best_actions = mdp.greedy_actions(q)
             policyIsStable = True
-            for s in bot.env.state_generator():
+            for i in range(mdp.num_enumerated):
+                s = mdp.states[i]
                 # skip terminal states
-                if bot.env.state_is_terminal(s): continue
-                # if s in self.env.terminal_states: continue # no need to do anything with the terminal states
+                if mdp.terminal[i] or not mdp.legal[i].any(): continue
                 oldAction = bot.pick_action(s)
-                # set a new action for the policy
-                # pick the action that maximizes the action-value function
-                # do that by picking the max value of the policy-keys (i.e. the actions) using the
-                # action-value-function as a "key" (i.e. the thing that the max function uses to evaluate the values)
-                best_action = max(bot.policy[s].keys(), key=lambda a: bot.action_value_fun(s, a, 0, gamma))
+                best_action = mdp.actions[best_actions[i]]
+                # only switch for a strictly better action, otherwise ties make the policy flip back and forth
+                if oldAction in mdp.action_index and q[i, mdp.action_index[oldAction]] >= q[i, best_actions[i]] - 1e-12:
+                    best_action = oldAction
                 # update the policy
                 bot.policy_set_action(s, best_action)
                 if best_action != oldAction:
@@ -78,22 +136,35 @@ class MarkovDecisionProcess():
                     policyIsStable = False
             if policyIsStable:
                 print("Policy Is Stable. Returning ...")
+                MarkovDecisionProcess.report(iterations=j, seconds=time.perf_counter() - start_time)
                 return v
             print()
 
     @staticmethod
-    def value_iteration(bot, accuracy_thresh, gamma, verbose=False):
+    def value_iteration(bot, accuracy_thresh, gamma, verbose=False, mode="sweep", subset_fraction=.1):
+        # mode: "sweep" backs up state by state in Python,
+        # the other modes work on the compiled tensors (see CompiledMDP.py) and differ in their backup schedule:
+        #   "vectorized":   every sweep is one batched backup of all states
+        #   "gauss_seidel": in-place sweeps, later states already use the new values of earlier ones
+        #   "prioritized":  prioritized sweeping, always backs up the state with the largest Bellman error
+        #   "async":        in-place backups of random subsets of subset_fraction * S states
+        # every mode reports the number of backups it needed (see MarkovDecisionProcess.stats)
+        if mode != "sweep":
+            return MarkovDecisionProcess.value_iteration_compiled(bot, accuracy_thresh, gamma, verbose, mode, subset_fraction)
         print("Performing Value Iteration")
+        start_time = time.perf_counter()
         v = MarkovDecisionProcess.init_v(bot.env)
+        backups = 0
         for j in range(1000000):
             Delta = 0
             for i, s in enumerate(bot.env.state_generator()):
                 # skip terminal states
-                if s in bot.env.terminal_states: continue
+                if bot.env.state_is_terminal(s): continue
                 w = v[s]
                 # get the maximum possible action-value function given the state s
                 # states are deterministic so no need to get probabilities of s_t_1
                 v[s] = max([bot.action_value_fun_star(s, a, gamma, v) for a in bot.policy[s].keys()])
+                backups += 1
                 Delta = max(Delta, abs(w - v[s]))
             if Delta < accuracy_thresh:
                 break
@@ -108,8 +179,132 @@ class MarkovDecisionProcess():
             best_action = max(bot.policy[s].keys(), key=lambda a: bot.action_value_fun_star(s, a, gamma, v))
             bot.policy_set_action(s, best_action)
             if verbose: print(f"State {s}: Best action = {best_action}")
+        MarkovDecisionProcess.report(sweeps=j + 1, backups=backups, seconds=time.perf_counter() - start_time)
         return v
 
+    @staticmethod
+    def value_iteration_compiled(bot, accuracy_thresh, gamma, verbose=False, mode="vectorized", subset_fraction=.1):
+        # value iteration on the compiled tensors with the backup schedule given by mode (see value_iteration)
+        # returns the same v dict as value_iteration and sets the greedy policy in the bot
+        print(f"Performing Value Iteration ({mode})")
+        start_time = time.perf_counter()
+        mdp = bot.env.compile()
+        v = mdp.v_array(MarkovDecisionProcess.init_v(bot.env))
+        if mode == "vectorized":
+            v, stats = MarkovDecisionProcess.vectorized_backups(mdp, v, gamma, accuracy_thresh)
+        elif mode == "gauss_seidel":
+            v, stats = MarkovDecisionProcess.gauss_seidel_backups(mdp, v, gamma, accuracy_thresh)
+        elif mode == "prioritized":
+            v, stats = MarkovDecisionProcess.prioritized_backups(mdp, v, gamma, accuracy_thresh)
+        elif mode == "async":
+            v, stats = MarkovDecisionProcess.async_backups(mdp, v, gamma, accuracy_thresh, bot.rng, subset_fraction)
+        else:
+            raise ValueError(f"Unknown value iteration mode: {mode}")
+        # Policy calculation: greedy w.r.t. the converged values
+        best_actions = mdp.greedy_actions(mdp.q_values(v, gamma))
+        for i in range(mdp.num_enumerated):
+            s = mdp.states[i]
+            # skip terminal states and states the bot has no policy for
+            if mdp.terminal[i] or not mdp.legal[i].any() or s not in bot.policy: continue
+            best_action = mdp.actions[best_actions[i]]
+            bot.policy_set_action(s, best_action)
+            if verbose: print(f"State {s}: Best action = {best_action}")
+        MarkovDecisionProcess.report(**stats, seconds=time.perf_counter() - start_time)
+        return mdp.v_dict(v)
+
+    @staticmethod
+    def bellman_errors(mdp, v, gamma):
+        # backs up all states at once and returns the new values and their distance to v
+        # states without any legal action (e.g. terminal states) keep a value of 0
+        v_new = np.where(mdp.legal.any(axis=1), mdp.q_values(v, gamma).max(axis=1), 0)
+        return v_new, np.abs(v_new - v)
+
+    @staticmethod
+    def vectorized_backups(mdp, v, gamma, accuracy_thresh):
+        # synchronous sweeps, each one a single NumPy contraction over (S, A, S')
+        # input: mdp (CompiledMDP), v (array (S,)), gamma (float), accuracy_thresh (float)
+        # output: v (array (S,)), stats (dict)
+        n = int(mdp.legal.any(axis=1).sum())
+        for j in range(1000000):
+            v, errors = MarkovDecisionProcess.bellman_errors(mdp, v, gamma)
+            if np.max(errors, initial=0) < accuracy_thresh:
+                break
+        return v, {"sweeps": j + 1, "backups": (j + 1) * n}
+
+    @staticmethod
+    def gauss_seidel_backups(mdp, v, gamma, accuracy_thresh):
+        # in-place sweeps in state index order, every backup already sees the values updated before it
+        v = v.copy()
+        states = np.flatnonzero(mdp.legal.any(axis=1))
+        backups = 0
+        for j in range(1000000):
+            Delta = 0
+            for i in states:
+                w = v[i]
+                v[i] = mdp.state_backup(i, v, gamma)
+                backups += 1
+                Delta = max(Delta, abs(w - v[i]))
+            if Delta < accuracy_thresh:
+                break
+        return v, {"sweeps": j + 1, "backups": backups}
+
+    @staticmethod
+    def prioritized_backups(mdp, v, gamma, accuracy_thresh):
+        # prioritized sweeping: a priority queue holds the states by their Bellman error,
+        # after backing up a state only its predecessors can have a new error, so only they get re-checked
+        v = v.copy()
+        can_backup = mdp.legal.any(axis=1)
+        predecessor_indptr, predecessor_states = mdp.predecessors()
+        # initial priorities from one batched backup of all states
+        v_new, errors = MarkovDecisionProcess.bellman_errors(mdp, v, gamma)
+        backups = int(can_backup.sum())
+        priority = np.where(errors > accuracy_thresh, errors, 0)
+        queue = [(-priority[i], i) for i in np.flatnonzero(priority)]
+        heapq.heapify(queue)
+        while queue:
+            p, i = heapq.heappop(queue)
+            # skip outdated queue entries, the state got pushed again with a higher priority or was already backed up
+            if -p != priority[i]: continue
+            priority[i] = 0
+            v[i] = mdp.state_backup(i, v, gamma)
+            backups += 1
+            for k in predecessor_states[predecessor_indptr[i]:predecessor_indptr[i + 1]]:
+                if not can_backup[k]: continue
+                error = abs(mdp.state_backup(k, v, gamma) - v[k])
+                backups += 1
+                if error > accuracy_thresh and error > priority[k]:
+                    priority[k] = error
+                    heapq.heappush(queue, (-error, k))
+        return v, {"backups": backups}
+
+    @staticmethod
+    def async_backups(mdp, v, gamma, accuracy_thresh, rng, subset_fraction=.1):
+        # asynchronous value iteration: in-place backups of random subsets of states,
+        # after every 1/subset_fraction subsets one batched backup checks whether all errors are below the threshold
+        # the subsets are drawn from rng (a RandomStream, e.g. bot.rng)
+        v = v.copy()
+        states = np.flatnonzero(mdp.legal.any(axis=1))
+        k = max(1, int(subset_fraction * len(states)))
+        rounds_per_check = max(1, int(round(1 / subset_fraction)))
+        backups = 0
+        for j in range(1000000):
+            for i in rng.generator.choice(states, size=k, replace=False):
+                v[i] = mdp.state_backup(i, v, gamma)
+                backups += 1
+            if (j + 1) % rounds_per_check == 0:
+                _, errors = MarkovDecisionProcess.bellman_errors(mdp, v, gamma)
+                backups += len(states)
+                if np.max(errors, initial=0) < accuracy_thresh:
+                    break
+        return v, {"subsets": j + 1, "backups": backups}
+
+    @staticmethod
+    def report(**stats):
+        # saves the statistics of the last run in MarkovDecisionProcess.stats and prints them
+        MarkovDecisionProcess.stats = stats
+        print(", ".join(f"{key}: {value:.4f}" if isinstance(value, float) else f"{key}: {value}"
+                        for key, value in stats.items()))
+
 
 
 def test_grid_world():
@@ -159,7 +354,7 @@ def test_grid_world():
     print("All done :)")
 
 
-def test_windy_grid_world():
+def test_windy_grid_world(mode="sweep"):
     h, w = 7, 10 # grid size
     wind_forces = [ # only vertical please
         (0, 0),
@@ -176,19 +371,19 @@ def test_windy_grid_world():
     env = WindyGridWorld(h, w, terminal_states=[(3, 7)], starting_state=(3, 0), forces=wind_forces)
     print(env)
     bot = Bot(env=env, T = 100)
-    v = MarkovDecisionProcess.value_iteration(bot, .001, 1)
+    v = MarkovDecisionProcess.value_iteration(bot, .001, 1, mode=mode)
     bot.draw_v(v)
     bot.draw_policy()
 
 
-def test_frozen_lake():
+def test_frozen_lake(evaluation="sweep"):
     h, w = 4, 4
     holes = [(3, 0), (1, 1), (1, 3), (2, 3)]
     goals = [(3, 3)]
     env = FrozenLake(h, w, goals, holes, (0, 0), slippery=False)
     print(env)
     bot = Bot(env=env, T = 100)
-    v = MarkovDecisionProcess.policy_iteration(bot, .001, 1)
+    v = MarkovDecisionProcess.policy_iteration(bot, .001, 1, evaluation=evaluation)
     bot.draw_v(v)
     bot.draw_policy()
 
@@ -197,9 +392,10 @@ def test_blackjack():
     env = BlackJack()
     print(env)
     bot = Bot(env=env, T = 100)
-    v = MarkovDecisionProcess.value_iteration(bot, .001, 1)
+    # the outcomes of BlackJack are exact (see BlackJack.dealer_distribution), so this solves the game exactly
+    v = MarkovDecisionProcess.value_iteration(bot, .001, 1, mode="vectorized")
     print(v)
-    print(bot.policy[:50])
+    print(list(bot.policy.items())[:50])
 
 
 
@@ -4,7 +4,6 @@
 # estimate the optimal policy π* via Monte Carlo sampling.
 
 from pprint import pprint
-import random
 import numpy as np
 
 from GridWorld import GridWorld
@@ -12,34 +11,58 @@ from Bot import Bot
 from BlackJack import BlackJack
 from CliffWalking import CliffWalking
 from FrozenLake import FrozenLake
+from Policy import TabularPolicy
+from QTable import QTable
 from WindyGridWorld import WindyGridWorld
 
 
-def MC_policy_control(bot: Bot, epsilon=.1, gamma=1, visit="first", off_policy=False, behaviour_policy=None, num_episodes=1000):
+def MC_policy_control(bot: Bot, epsilon=.1, gamma=1, visit="first", off_policy=False, behaviour_policy=None, num_episodes=1000,
+                      alpha=None, track_variance=False, n_workers=None, batch_size=1000, seed=None,
+                      lazy=False, capacity=None):
     # performs Monte Carlo policy control (on-policy or off-policy)
-    # inputs: bot (Bot), epsilon (float), gamma (float), visit (str), off_policy (bool), behaviour_policy (dict), num_episodes (int)
-    # outputs: none (updates bot.policy in place)
+    # inputs: bot (Bot), epsilon (float), gamma (float),
+    #         visit (str): "first" (first visit of a state), "first_sa" (first visit of a state-action pair) or "every",
+    #         off_policy (bool), behaviour_policy (dict), num_episodes (int),
+    #         alpha (float or None): None averages all returns of a state-action pair (incremental sample mean),
+    #                                a float moves Q towards every return with that constant step size
+    #         track_variance (bool): also keep the variance of the returns (Welford's algorithm, or its
+    #                                exponentially weighted version for constant alpha), see return_confidence_interval
+    #         n_workers (int or None): generate the episodes in that many processes (see Bot.rollouts),
+    #                                      in batches of batch_size episodes that all use the policy from before the batch
+    #         seed (int or None): seed of the parallel episode generation
+    #         lazy (bool): do not enumerate the states beforehand, Q gets a row for each state on its first visit
+    #         capacity (int or None): max number of states kept in Q, the least recently used ones get evicted (implies lazy)
+    # outputs: bot.policy, v (dict) and, if track_variance is set, a dict with the QTables "Q", "counts" and "variance"
     if off_policy:
         behaviour_policy = bot.policy.copy()
     else: # on-policy: use the Bot's policy for the episodes, while also updating it
         behaviour_policy = bot.policy
 
     # estimate q with Q
-    # Q is the action-value-function: maps from state to action to action-value
-    Q = {}
-    # dict: maps from state to action to a list of all returns received
-    returns = {}
-    for s in bot.env.state_generator():
-        Q[s] = {a: 0.0 for a in bot.env.actions}
-        returns[s] = {a: [] for a in bot.env.actions}
-
-    for k in range(num_episodes):
+    # Q is the action-value-function: maps from state to action to action-value (see QTable.py)
+    # instead of keeping every return, only the number of returns and their running mean (Q) are stored
+    # Q.extras["N"][i, j]: number of returns received for state i and action j
+    # Q.extras["M2"]: sum of squared deviations from the mean (Welford), or the variance itself for constant alpha
+    # both share the rows of Q, so they grow and get evicted together with it
+    extra_arrays = {"N": np.int64, "M2": np.float64} if track_variance else {"N": np.int64}
+    if lazy or capacity is not None:
+        Q = QTable(bot.env.actions, capacity=capacity, extra_arrays=extra_arrays)
+    else:
+        Q = QTable(bot.env.actions, bot.env.state_generator(), extra_arrays=extra_arrays)
+
+    for k, transitions in enumerate(MC_episodes(bot, epsilon, behaviour_policy, num_episodes, n_workers, batch_size, seed)):
         if k % (num_episodes//10) == 0:
             print(f"Iteration {k}")
 
-        # generate an episode
-        R_k, t_k, transitions = bot.episode(epsilon=epsilon, policy=behaviour_policy)
         # transitions looks like this: [(S0, A0, R1, S1), (S1, A1, R2, S2), ..., (ST-1, AT-1, RT, _)]
+        # for first visit MC: one forward pass finds the time-step of the first occurrence of each state
+        # (or state-action pair), so the backward pass below can check for the first visit in O(1)
+        if visit != "every":
+            first_occurrence = {}
+            for t, transition in enumerate(transitions):
+                key = (transition[0], transition[1]) if visit == "first_sa" else transition[0]
+                if key not in first_occurrence:
+                    first_occurrence[key] = t
         g = 0
         # iterate over sequence backwards!
         for t in range(len(transitions)-1, -1, -1):
@@ -47,33 +70,83 @@ def MC_policy_control(bot: Bot, epsilon=.1, gamma=1, visit="first", off_policy=F
             g = gamma * g + transitions[t][2]
             s_t = transitions[t][0]
             a_t = transitions[t][1]
-            # for first visit MC, check if the state occurred before the current time-step, then save its return
+            # for first visit MC, only save the return if the state did not occur before the current time-step
             # for every visit MC, save its return anyway
-            # TODO: moch des effizienter indem nicht jedes verfickte Mal alle previous_transitions gecheckt werden
-            if any(previous_transition[0] == s_t for previous_transition in transitions[:t]) or visit == "every":
-                # save g to the returns list for the current state and action
-                returns[s_t][a_t].append(g)
-                # update Q, the state-value mapping
-                Q[s_t][a_t] = np.mean(returns[s_t][a_t])
+            if visit == "every" or first_occurrence[(s_t, a_t) if visit == "first_sa" else s_t] == t:
+                # update Q, the state-value mapping, with the new return g
+                i, j = Q.index(s_t), Q.action_index[a_t]
+                # fetched after Q.index, which may have grown the arrays
+                N, M2 = Q.extras["N"], Q.extras.get("M2")
+                N[i, j] += 1
+                delta = g - Q.table[i, j]
+                step_size = 1 / N[i, j] if alpha is None else alpha
+                Q.set_by_index(i, j, Q.table[i, j] + step_size * delta)
+                if track_variance:
+                    if alpha is None:
+                        M2[i, j] += delta * (g - Q.table[i, j])
+                    else:
+                        M2[i, j] = (1 - alpha) * (M2[i, j] + alpha * delta ** 2)
                 # get the action that leads to the maximum value in the current state according to Q
                 # ties are broken randomly
-                a_optimal = random.choice([
-                    a for a, v in Q[s_t].items()
-                    if v == max(Q[s_t].values())
-                ])
+                a_optimal = Q.actions[bot.rng.choice(np.flatnonzero(Q.table[i] == Q.table[i].max()))]
                 # update the Bot policy (not necessarily the behaviour_policy) for all actions in the current state
-                for a in bot.env.actions:
-                    # TODO: the following check is also in the Bot.policy class
-                    # maybe we should generalize this ...
-                    # if there is no policy rule for this state yet, create it
-                    if s_t not in bot.policy.keys():
-                        possible_actions = [a for a in bot.env.actions if bot.env.is_this_action_possible(s_t, a)]
-                        bot.policy[s_t] = {a:1/len(possible_actions) for a in possible_actions}
-                    bot.policy[s_t][a] = (1 - epsilon + epsilon/len(Q[s_t])) if a_optimal == a else epsilon/len(Q[s_t])
+                # the whole rule is set at once, this also creates it if the state has no rule yet
+                bot.policy[s_t] = {a: (1 - epsilon + epsilon/len(Q.actions)) if a_optimal == a else epsilon/len(Q.actions)
+                                   for a in bot.env.actions}
     print()
     # compute v damit ich es so wie der markus plotten kann amk
-    v = {s: max(Q[s].values()) for s, a in Q.items()}
-    return bot.policy, v
+    v = {s: Q.max_value(s) for s in Q}
+    if not track_variance:
+        return bot.policy, v
+    N, M2 = Q.extras["N"][:len(Q)], Q.extras["M2"][:len(Q)]
+    counts = QTable(Q.actions, Q.states)
+    counts.table = N.astype(np.float64)
+    variance = QTable(Q.actions, Q.states)
+    if alpha is None:
+        # sample variance from Welford's sum of squares
+        variance.table = np.divide(M2, N - 1, out=np.zeros_like(M2), where=N > 1)
+    else:
+        variance.table = M2
+    return bot.policy, v, {"Q": Q, "counts": counts, "variance": variance}
+
+
+def MC_episodes(bot: Bot, epsilon, behaviour_policy, num_episodes, n_workers=None, batch_size=1000, seed=None):
+    # generates the transitions of num_episodes episodes, one after another or in parallel batches
+    # inputs: see MC_policy_control; outputs: generator of transition lists
+    if n_workers is None or n_workers <= 1:
+        for k in range(num_episodes):
+            R_k, t_k, transitions = bot.episode(epsilon=epsilon, policy=behaviour_policy)
+            yield transitions
+        return
+    # the worker processes are started once with a copy of the bot
+    # a fixed (off-policy) behaviour policy is shipped along once, the on-policy TabularPolicy changes after every batch,
+    # so each batch only ships its probabilities (see Bot.policy_update)
+    # (other on-policy policies are shipped whole with every batch)
+    fixed = behaviour_policy is not bot.policy
+    tabular = not fixed and isinstance(bot.policy, TabularPolicy)
+    kwargs = {} if fixed or tabular else {"policy": behaviour_policy}
+    batch_seeds = np.random.SeedSequence(seed).spawn((num_episodes + batch_size - 1) // batch_size)
+    with bot.rollout_pool(n_workers, policy=behaviour_policy if fixed else None) as pool:
+        pool_size = len(bot.policy) if tabular else 0
+        for b, batch_seed in enumerate(batch_seeds):
+            k = min(batch_size, num_episodes - b * batch_size)
+            _, _, batch = bot.rollouts(k, n_workers=n_workers, seed=batch_seed, return_transitions=True, pool=pool,
+                                       policy_update=bot.policy_update(pool_size) if tabular else None,
+                                       epsilon=epsilon, **kwargs)
+            yield from batch
+
+
+def return_confidence_interval(stats, s, a, z=1.96):
+    # normal approximation of the confidence interval of Q[s][a], using the stats returned by
+    # MC_policy_control(..., track_variance=True)
+    # inputs: stats (dict), s (state), a (action), z (float, 1.96 -> 95%)
+    # outputs: (lower, upper) bounds
+    n = stats["counts"].get(s, a)
+    if n == 0:
+        return -np.inf, np.inf
+    q = stats["Q"].get(s, a)
+    half_width = z * np.sqrt(stats["variance"].get(s, a) / n)
+    return q - half_width, q + half_width
 
 
 def test(env, epsilon=.4, num_episodes=1000, off_policy=True, verbose=False, num_test_runs=1000, T=100):
@@ -1,5 +1,4 @@
 from pprint import pprint
-import random
 
 from Environment import Environment
 
@@ -21,7 +20,7 @@ class Mäxchen(Environment):
         super().__init__(actions)
 
     def toss_dice(self):
-        x, y = random.randint(1, 6), random.randint(1, 6)
+        x, y = self.rng.randint(1, 6), self.rng.randint(1, 6)
         print(x, y)
         return self.get_value(x, y)
 
@@ -0,0 +1,264 @@
+# ===================================================
+# Author: Nikolaus Czernin
+# Script: Policy views
+# Description: Policies that can be used as Bot.policy instead of a dict {state: {action: prob}}.
+#              GreedyPolicy derives the greedy policy from an action-value table on demand,
+#              so learners don't have to rebuild the whole policy whenever Q changes.
+#              TabularPolicy stores the probabilities in an (S, A) array with a legal-action mask,
+#              caches the most probable action of every state and samples epsilon-greedy actions
+#              with a cumulative sum, while still supporting policy[s][a] like a dict.
+# ===================================================
+
+
+import numpy as np
+
+
+class GreedyPolicy():
+    # greedy policy w.r.t. an action-value source q, which needs
+    #   q.actions, q.greedy_action(s) and s in q (e.g. a QTable)
+    # policy[s] is computed from q when it is accessed, so it is always up to date
+    # states can also be set explicitly (set_action, policy[s] = {...}), these overrides win over q
+    def __init__(self, q):
+        self.q = q
+        self.actions = q.actions
+        self.overrides = {}
+
+    def greedy_action(self, s):
+        # the action the policy picks in state s
+        if s in self.overrides:
+            rule = self.overrides[s]
+            return max(rule, key=rule.get)
+        return self.q.greedy_action(s)
+
+    def set_action(self, s, a_new):
+        # fixes the action of state s to a_new, independent of q
+        self.overrides[s] = {a: 1 if a == a_new else 0 for a in self.actions}
+
+    def __getitem__(self, s):
+        if s in self.overrides:
+            return self.overrides[s]
+        a_best = self.q.greedy_action(s)
+        return {a: 1 if a == a_best else 0 for a in self.actions}
+
+    def __setitem__(self, s, rule):
+        self.overrides[s] = rule
+
+    def __contains__(self, s):
+        # a lazy q (see QTable) knows every state, its row is created on the first access
+        return s in self.overrides or s in self.q or getattr(self.q, "lazy", False)
+
+    def keys(self):
+        return list(self.q.keys()) + [s for s in self.overrides if s not in self.q]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(s, self[s]) for s in self.keys()]
+
+    def copy(self):
+        other = GreedyPolicy(self.q)
+        other.overrides = dict(self.overrides)
+        return other
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class PolicyRow():
+    # dict-like view of the action probabilities of a single state, reads and writes go to the TabularPolicy
+    def __init__(self, policy, i):
+        self.policy = policy
+        self.i = i
+
+    def __getitem__(self, a):
+        return float(self.policy.probs[self.i, self.policy.action_index[a]])
+
+    def __setitem__(self, a, prob):
+        self.policy.probs[self.i, self.policy.action_index[a]] = prob
+        self.policy.refresh(self.i)
+
+    def get(self, a, default=None):
+        if a not in self.policy.action_index: return default
+        return self[a]
+
+    def keys(self):
+        return list(self.policy.actions)
+
+    def values(self):
+        return [float(p) for p in self.policy.probs[self.i]]
+
+    def items(self):
+        return list(zip(self.keys(), self.values()))
+
+    def __iter__(self):
+        return iter(self.policy.actions)
+
+    def __len__(self):
+        return len(self.policy.actions)
+
+    def __contains__(self, a):
+        return a in self.policy.action_index
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class TabularPolicy():
+    # policy pi(a|s) as an (S, A) probability array, with a mask of the legal actions of every state
+    # policy[s] is a dict-like row (PolicyRow), policy[s] = {action: prob} sets a whole row
+    # states that are not in the policy yet get a row when they are first set or sampled
+    # for single states the most probable actions and the legal actions are cached as lists,
+    # small rows are faster in plain Python than with NumPy calls; many states are sampled at once with sample_actions
+    def __init__(self, actions, states=(), legal_mask=None):
+        # input: actions (list), states (iterable, they start equiprobable over their legal actions),
+        #        legal_mask (callable state -> one bool per action, e.g. Environment.legal_mask,
+        #        None -> all actions are legal)
+        self.actions = list(actions)
+        self.action_index = {a: j for j, a in enumerate(self.actions)}
+        self.get_legal_mask = legal_mask
+        self.states = []
+        self.state_index = {}
+        for s in states:
+            if s not in self.state_index:
+                self.state_index[s] = len(self.states)
+                self.states.append(s)
+        self.legal = np.array([self.legal_mask(s) for s in self.states], dtype=bool).reshape(len(self.states), len(self.actions))
+        n_legal = self.legal.sum(axis=1, keepdims=True)
+        self.probs = np.divide(self.legal, n_legal, out=np.zeros(self.legal.shape), where=n_legal > 0)
+        # legal actions of every state, and the actions with the highest probability
+        self.legal_actions = [[a for a, legal in zip(self.actions, row) if legal] for row in self.legal]
+        self.best_actions = [None] * len(self.states)
+        for i in range(len(self.states)):
+            self.refresh(i)
+
+    def legal_mask(self, s):
+        # legal actions of state s as a list of bools
+        if self.get_legal_mask is None: return [True] * len(self.actions)
+        return list(self.get_legal_mask(s))
+
+    def add_state(self, s):
+        # adds a row for s, equiprobable over its legal actions; output: int (row index)
+        i = len(self.states)
+        if i == len(self.probs):
+            # double the allocated rows
+            rows = max(2 * len(self.probs), 16)
+            for name in ("probs", "legal"):
+                old = getattr(self, name)
+                new = np.zeros((rows,) + old.shape[1:], dtype=old.dtype)
+                new[:len(old)] = old
+                setattr(self, name, new)
+        self.state_index[s] = i
+        self.states.append(s)
+        self.legal[i] = self.legal_mask(s)
+        self.legal_actions.append([a for a, legal in zip(self.actions, self.legal[i]) if legal])
+        self.probs[i] = self.legal[i] / len(self.legal_actions[i]) if self.legal_actions[i] else 0
+        self.best_actions.append(None)
+        self.refresh(i)
+        return i
+
+    def index(self, s):
+        # row index of s, a new row is created for unknown states
+        i = self.state_index.get(s)
+        return self.add_state(s) if i is None else i
+
+    def refresh(self, i):
+        # recomputes the cached most probable actions of row i, needed after its probabilities changed
+        row = self.probs[i]
+        self.best_actions[i] = [self.actions[j] for j in np.flatnonzero(row == row.max())]
+
+    def set_row(self, s, rule):
+        # sets the probabilities of state s, actions missing in rule get 0
+        # input: s (state), rule (dict {action: prob})
+        i = self.index(s)
+        self.probs[i] = 0
+        for a, prob in rule.items():
+            self.probs[i, self.action_index[a]] = prob
+        self.refresh(i)
+
+    def set_rows(self, rows, probs):
+        # sets the probabilities of many rows at once, only the changed rows get their most probable actions recomputed
+        # input: rows (int array of row indices), probs (array (len(rows), A))
+        changed = (self.probs[rows] != probs).any(axis=1)
+        rows, probs = rows[changed], probs[changed]
+        self.probs[rows] = probs
+        ties = probs == probs.max(axis=1, keepdims=True)
+        for i, tie in zip(rows.tolist(), ties.tolist()):
+            self.best_actions[i] = [a for a, t in zip(self.actions, tie) if t]
+
+    def set_action(self, s, a_new):
+        # fixes the action of state s to a_new
+        i = self.index(s)
+        self.probs[i] = 0
+        self.probs[i, self.action_index[a_new]] = 1
+        self.best_actions[i] = [a_new]
+
+    def greedy_action(self, s, rng):
+        # the most probable action in state s, ties are broken randomly (like Bot.pick_action)
+        # rng: RandomStream (e.g. Bot.rng)
+        best = self.best_actions[self.index(s)]
+        return best[0] if len(best) == 1 else rng.choice(best)
+
+    def sample_action(self, s, epsilon, rng):
+        # epsilon-greedy pick in state s: with probability epsilon a random legal action,
+        # otherwise the most probable action (ties are random); rng: see greedy_action
+        i = self.index(s)
+        if epsilon > 0 and self.legal_actions[i] and rng.random() < epsilon:
+            return rng.choice(self.legal_actions[i])
+        best = self.best_actions[i]
+        return best[0] if len(best) == 1 else rng.choice(best)
+
+    def sample_actions(self, rows, epsilon, rng):
+        # vectorized sample_action for many states at once: the greedy and the exploring part are mixed into
+        # one distribution per state, which is sampled with its cumulative sum
+        # input: rows (int array of row indices, see index), epsilon (float), rng (numpy Generator or RandomStream)
+        # output: int array of action indices
+        probs, legal = self.probs[rows], self.legal[rows]
+        ties = probs == probs.max(axis=1, keepdims=True)
+        p = ties * ((1 - max(epsilon, 0)) / ties.sum(axis=1, keepdims=True))
+        if epsilon > 0:
+            n_legal = legal.sum(axis=1, keepdims=True)
+            p = p + np.divide(legal * epsilon, n_legal, out=np.zeros(p.shape), where=n_legal > 0)
+        cumulative = np.cumsum(p, axis=1)
+        u = rng.random(len(rows)) * cumulative[:, -1]
+        return np.argmax(cumulative > u[:, None], axis=1)
+
+    def __getitem__(self, s):
+        return PolicyRow(self, self.state_index[s])
+
+    def __setitem__(self, s, rule):
+        self.set_row(s, rule)
+
+    def __contains__(self, s):
+        return s in self.state_index
+
+    def keys(self):
+        return list(self.states)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.states)
+
+    def items(self):
+        return [(s, self[s]) for s in self.states]
+
+    def copy(self):
+        other = TabularPolicy(self.actions, (), self.get_legal_mask)
+        other.states = list(self.states)
+        other.state_index = dict(self.state_index)
+        other.probs, other.legal = self.probs.copy(), self.legal.copy()
+        other.legal_actions = [list(actions) for actions in self.legal_actions]
+        other.best_actions = [list(actions) for actions in self.best_actions]
+        return other
+
+    def to_dict(self):
+        # the policy as a dict of dicts {state: {action: prob}}
+        return {s: dict(zip(self.actions, (float(p) for p in self.probs[i]))) for i, s in enumerate(self.states)}
+
+    def __repr__(self):
+        return repr(self.to_dict())
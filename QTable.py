@@ -0,0 +1,223 @@
+# ===================================================
+# Author: Nikolaus Czernin
+# Script: Array-backed action-value table
+# Description: Q-table for tabular learners. States are mapped to row indices,
+#              the action-values live in a float64 (S, A) NumPy array and the greedy action
+#              of every state is cached, so argmax lookups are O(1).
+#              Q[s] returns a dict-like view of a row, so Q[s][a] works like before.
+#              Without a list of states the table is lazy: rows are created when a state is first touched,
+#              optionally with a capacity, above which the least recently used states are evicted.
+# ===================================================
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+class QRow():
+    # dict-like view of the action-values of a single state, reads and writes go to the QTable
+    def __init__(self, qtable, i):
+        self.qtable = qtable
+        self.i = i
+
+    def __getitem__(self, a):
+        return float(self.qtable.table[self.i, self.qtable.action_index[a]])
+
+    def __setitem__(self, a, value):
+        self.qtable.set_by_index(self.i, self.qtable.action_index[a], value)
+
+    def get(self, a, default=None):
+        if a not in self.qtable.action_index: return default
+        return self[a]
+
+    def keys(self):
+        return list(self.qtable.actions)
+
+    def values(self):
+        return [float(x) for x in self.qtable.table[self.i]]
+
+    def items(self):
+        return list(zip(self.keys(), self.values()))
+
+    def __iter__(self):
+        return iter(self.qtable.actions)
+
+    def __len__(self):
+        return len(self.qtable.actions)
+
+    def __contains__(self, a):
+        return a in self.qtable.action_index
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class QTable():
+    def __init__(self, actions, states=None, default_value=0.0, capacity=None, extra_arrays=None):
+        # input: actions (list),
+        #        states (iterable of hashable states, or None for a lazy table that adds states on first touch),
+        #        default_value (float), capacity (int or None, max number of states of a lazy table,
+        #        the least recently used state is evicted to make room for a new one),
+        #        extra_arrays (dict {name: dtype} or None, more (S, A) arrays that share the rows of the table,
+        #                      e.g. visit counts, see self.extras)
+        self.actions = list(actions)
+        self.action_index = {a: j for j, a in enumerate(self.actions)}
+        self.default_value = default_value
+        self.lazy = states is None
+        self.capacity = capacity
+        # state -> row index, in order of the last access if there is a capacity
+        self.state_index = OrderedDict() if capacity is not None else {}
+        # row index -> state
+        self.states = []
+        if not self.lazy:
+            for s in states:
+                if s not in self.state_index:
+                    self.state_index[s] = len(self.states)
+                    self.states.append(s)
+        rows = len(self.states) if not self.lazy else min(capacity or 64, 64)
+        self.data = np.full((rows, len(self.actions)), default_value, dtype=np.float64)
+        self.extras = {name: np.zeros((rows, len(self.actions)), dtype=dtype)
+                       for name, dtype in (extra_arrays or {}).items()}
+        # index of the greedy action of every state, ties go to the first action like max(Q[s], key=Q[s].get)
+        self.best = np.zeros(rows, dtype=np.int64)
+        # statistics of the lazy table
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+    @property
+    def table(self):
+        # the (S, A) array of action-values (a view, writes go into the table)
+        return self.data[:len(self.states)]
+
+    @table.setter
+    def table(self, values):
+        # written into the allocated rows, so data, best and the extras keep the same number of rows
+        self.data[:len(self.states)] = values
+        self.recompute_best()
+
+    def index(self, s):
+        # row index of a state, a lazy table creates the row if s is new
+        # input: s (state); output: int
+        if s in self.state_index:
+            if self.capacity is not None:
+                self.state_index.move_to_end(s)
+            self.hits += 1
+            return self.state_index[s]
+        if not self.lazy:
+            raise KeyError(s)
+        self.misses += 1
+        if self.capacity is not None and len(self.states) >= self.capacity:
+            # reuse the row of the least recently used state
+            _, i = self.state_index.popitem(last=False)
+            self.evictions += 1
+            self.states[i] = s
+        else:
+            i = len(self.states)
+            if i == len(self.data):
+                self.grow()
+            self.states.append(s)
+        self.state_index[s] = i
+        self.data[i] = self.default_value
+        self.best[i] = 0
+        for extra in self.extras.values():
+            extra[i] = 0
+        return i
+
+    def grow(self):
+        # doubles the number of allocated rows (up to the capacity)
+        rows = max(2 * len(self.data), 16)
+        if self.capacity is not None: rows = min(rows, self.capacity)
+        def resized(array, fill):
+            new_array = np.full((rows,) + array.shape[1:], fill, dtype=array.dtype)
+            new_array[:len(array)] = array
+            return new_array
+        self.data = resized(self.data, self.default_value)
+        self.best = resized(self.best, 0)
+        self.extras = {name: resized(extra, 0) for name, extra in self.extras.items()}
+
+    def get(self, s, a):
+        # Q(s, a); input: s (state), a (action); output: float
+        return self.data[self.index(s), self.action_index[a]]
+
+    def set(self, s, a, value):
+        # sets Q(s, a) = value and keeps the cached greedy action of s up to date
+        self.set_by_index(self.index(s), self.action_index[a], value)
+
+    def set_by_index(self, i, j, value):
+        # like set, but with row and column index
+        best = self.best[i]
+        old_value = self.data[i, j]
+        self.data[i, j] = value
+        if j == best:
+            # the greedy action got worse, another action may be better now
+            if value < old_value:
+                self.best[i] = np.argmax(self.data[i])
+        elif value > self.data[i, best] or (value == self.data[i, best] and j < best):
+            self.best[i] = j
+
+    def add_by_index(self, rows, cols, deltas):
+        # Q[rows, cols] += deltas for many entries at once, repeated entries add up
+        # input: rows, cols (int arrays), deltas (float array)
+        np.add.at(self.data, (rows, cols), deltas)
+        rows = np.unique(rows)
+        self.best[rows] = np.argmax(self.data[rows], axis=1)
+
+    def recompute_best(self):
+        # recomputes the greedy actions of all states, needed after writing to self.table directly
+        self.best = np.argmax(self.data, axis=1) if len(self.data) else np.zeros(0, dtype=np.int64)
+
+    def greedy_action(self, s):
+        # action with the highest value in state s (O(1), cached); input: s (state); output: action
+        return self.actions[self.best[self.index(s)]]
+
+    def max_value(self, s):
+        # max_a Q(s, a); input: s (state); output: float
+        i = self.index(s)
+        return self.data[i, self.best[i]]
+
+    def epsilon_greedy_action(self, s, epsilon, rng):
+        # with probability epsilon a random action, otherwise the greedy one
+        # rng: RandomStream (e.g. Bot.rng)
+        if rng.random() < epsilon:
+            return rng.choice(self.actions)
+        return self.greedy_action(s)
+
+    def stats(self):
+        # size and cache statistics of the table
+        return {"size": len(self.states), "capacity": self.capacity,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def copy(self):
+        # deep copy of the table
+        other = QTable(self.actions, None if self.lazy else [], self.default_value, self.capacity)
+        other.lazy = self.lazy
+        other.states = list(self.states)
+        other.state_index = self.state_index.copy()
+        other.data = self.data.copy()
+        other.best = self.best.copy()
+        other.extras = {name: extra.copy() for name, extra in self.extras.items()}
+        return other
+
+    def to_dict(self):
+        # the table as a dict of dicts {state: {action: value}}
+        return {s: dict(zip(self.actions, (float(x) for x in self.data[i]))) for s, i in self.state_index.items()}
+
+    def __getitem__(self, s):
+        return QRow(self, self.index(s))
+
+    def __contains__(self, s):
+        return s in self.state_index
+
+    def __len__(self):
+        return len(self.states)
+
+    def __iter__(self):
+        return iter(list(self.state_index))
+
+    def keys(self):
+        return list(self.state_index)
+
+    def items(self):
+        return [(s, self[s]) for s in self.keys()]
+
+    def __repr__(self):
+        return repr(self.to_dict())
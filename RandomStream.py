@@ -0,0 +1,58 @@
+# ===================================================
+# Author: Nikolaus Czernin
+# Script: Random streams
+# Description: Every Environment and Bot owns a RandomStream, a seeded numpy Generator instead of the global
+#              random / np.random state, so runs are reproducible and parallel workers get independent streams
+#              (see spawn). Single draws in the episode loop come from a buffer of uniforms that the Generator
+#              fills in batches, one scalar Generator call per draw would cost more than the draw itself.
+#              Scalar draws use the same method names as the random module (random, choice, randint),
+#              array draws (random(size), normal) go straight to the Generator.
+# ===================================================
+
+from bisect import bisect_right
+
+import numpy as np
+
+
+class RandomStream():
+    def __init__(self, seed=None, buffer_size=1024):
+        # input: seed (int, SeedSequence or None for fresh entropy), buffer_size (int, uniforms drawn per refill)
+        self.seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self.generator = np.random.default_rng(self.seed_sequence)
+        self.buffer_size = buffer_size
+        self.uniforms = []
+        self.position = 0
+
+    def spawn(self, n):
+        # n independent child streams, e.g. one per worker or component; output: list of RandomStream
+        return [RandomStream(seed, self.buffer_size) for seed in self.seed_sequence.spawn(n)]
+
+    def random(self, size=None):
+        # a uniform float in [0, 1) from the buffer, or an array of them straight from the Generator
+        # input: size (int, tuple or None); output: float or array
+        if size is not None:
+            return self.generator.random(size)
+        if self.position == len(self.uniforms):
+            self.uniforms = self.generator.random(self.buffer_size).tolist()
+            self.position = 0
+        u = self.uniforms[self.position]
+        self.position += 1
+        return u
+
+    def normal(self, loc=0.0, scale=1.0, size=None):
+        # normal samples straight from the Generator
+        return self.generator.normal(loc, scale, size)
+
+    def choice(self, seq):
+        # a uniformly random element of a non-empty sequence, like random.choice
+        return seq[int(self.random() * len(seq))]
+
+    def randint(self, a, b):
+        # a random int in [a, b], both included, like random.randint
+        return a + int(self.random() * (b - a + 1))
+
+    def weighted_choice(self, population, cum_weights):
+        # an element of population picked with the given cumulative weights, like random.choices(...)[0]
+        # input: population (sequence), cum_weights (increasing sequence of the same length)
+        i = bisect_right(cum_weights, self.random() * cum_weights[-1])
+        return population[min(i, len(population) - 1)]
@@ -0,0 +1,56 @@
+# ===================================================
+# Author: Nikolaus Czernin
+# Script: Experience replay buffer
+# Description: Ring buffer of transitions (state index, action index, reward, next state index, done)
+#              in preallocated NumPy arrays, so every environment step can be learned from many times.
+#              The indices are row/column indices of a QTable. Transitions are sampled uniformly or
+#              proportionally to a priority (e.g. the size of their last TD error).
+# ===================================================
+
+import numpy as np
+
+
+class ReplayBuffer():
+    def __init__(self, capacity, rng):
+        # input: capacity (int, the oldest transition is overwritten when the buffer is full),
+        #        rng (numpy Generator or RandomStream, e.g. Bot.rng)
+        self.capacity = capacity
+        self.rng = rng
+        self.states = np.zeros(capacity, dtype=np.int64)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float64)
+        self.next_states = np.zeros(capacity, dtype=np.int64)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.priorities = np.zeros(capacity, dtype=np.float64)
+        # position of the next write and number of stored transitions
+        self.position = 0
+        self.size = 0
+
+    def add(self, s, a, r, s_t_1, done, priority=None):
+        # stores a transition, without a priority it gets the highest one so far (so it is sampled soon)
+        # input: s, a, s_t_1 (int indices), r (float), done (bool), priority (float or None)
+        i = self.position
+        self.states[i], self.actions[i], self.rewards[i], self.next_states[i], self.dones[i] = s, a, r, s_t_1, done
+        if priority is None:
+            priority = self.priorities[:self.size].max() if self.size else 1.0
+        self.priorities[i] = priority
+        self.position = (self.position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample(self, batch_size, prioritized=False, alpha=.6):
+        # draws batch_size transitions with replacement, uniformly or with probability ~ priority ** alpha
+        # output: idx, states, actions, rewards, next_states, dones (arrays of length batch_size)
+        if prioritized:
+            weights = np.cumsum(self.priorities[:self.size] ** alpha)
+            idx = np.searchsorted(weights, self.rng.random(batch_size) * weights[-1], side="right")
+            idx = np.minimum(idx, self.size - 1)
+        else:
+            idx = (self.rng.random(batch_size) * self.size).astype(np.int64)
+        return idx, self.states[idx], self.actions[idx], self.rewards[idx], self.next_states[idx], self.dones[idx]
+
+    def update_priorities(self, idx, priorities):
+        # sets new priorities of sampled transitions; input: idx (array), priorities (array)
+        self.priorities[idx] = priorities
+
+    def __len__(self):
+        return self.size
@@ -1,30 +1,41 @@
 from pprint import pprint
-from random import random
 
 from matplotlib import pyplot as plt
+import numpy as np
 
+from AutoregressiveTrendProcess import AutoregressiveTrendProcess
 from Bot import Bot
 from CliffWalking import CliffWalking
+from Discretizer import DiscretizedEnvironment, TileCoder
+from EligibilityTraces import DenseTraces, SparseTraces
 from GridWorld import GridWorld
+from LinearQ import IndexFeatures, LinearQ, TileFeatures
+from QTable import QTable
+from ReplayBuffer import ReplayBuffer
 from utils import plot_blockwise_mean_rewards_line_graph, plot_line_graph
 
 
-def SARSA(bot:Bot, alpha=.5, epsilon=.1, gamma=1.0, num_episodes=1000, expected=False):
+def init_Q(bot:Bot, lazy=False, capacity=None):
+    # init action-value function (tabular, see QTable.py)
+    # lazy: do not enumerate the states beforehand, add them on first touch (for huge or continuous state spaces)
+    # capacity: max number of states of the lazy table, the least recently used ones get evicted (implies lazy)
+    if lazy or capacity is not None:
+        return QTable(bot.env.actions, capacity=capacity)
+    return QTable(bot.env.actions, bot.env.state_generator())
+
+
+def SARSA(bot:Bot, alpha=.5, epsilon=.1, gamma=1.0, num_episodes=1000, expected=False, lazy=False, capacity=None):
     if expected: print("Performing Expected-SARSA...")
     else: print("Performing SARSA...")
-    # init action-value function (tabular, finite)
-    # should we consider all states beforehand?
-    Q = {s:{a:0 for a in bot.env.actions} for s in bot.env.state_generator()}
+    # init action-value function (tabular, see init_Q)
+    Q = init_Q(bot, lazy, capacity)
+    # the policy of the bot is the greedy policy w.r.t. Q, it follows every update of Q
+    bot.set_greedy_policy(Q)
     total_rewards = [] # keep a list of total rewards for each episode
     for k in range(num_episodes):
         episode_reward = 0
         # reset the env
         bot.env.reset()
-        # before every episode: set a policy according to Q
-        for s in Q.keys():
-            # update the policy of the bot
-            bot.policy_set_action(s, max(Q[s], key=Q[s].get))
-
         # initialize s
         s_t = bot.env.starting_state
         # choose action a from s_t using e-greedy policy
@@ -41,15 +52,18 @@ def SARSA(bot:Bot, alpha=.5, epsilon=.1, gamma=1.0, num_episodes=1000, expected=
             a_t_1 = bot.pick_action(s_t_1, epsilon)
             # perform update of Q using SARSA update formula
             # if the next state is terminal, its future reward is zero
+            # the entry of (s_t, a_t) is looked up once, the rest of the update works on its row and column index
+            i_t, j_t = Q.index(s_t), Q.action_index[a_t]
+            q = Q.data[i_t, j_t]
             if bot.env.state_is_terminal(s_t_1):
-                Q[s_t][a_t] = Q[s_t][a_t] + alpha * (r - Q[s_t][a_t])
+                Q.set_by_index(i_t, j_t, q + alpha * (r - q))
             else:
                 if not expected:
-                    Q[s_t][a_t] = Q[s_t][a_t] + alpha * (r + gamma * Q[s_t_1][a_t_1] - Q[s_t][a_t])
+                    Q.set_by_index(i_t, j_t, q + alpha * (r + gamma * Q.get(s_t_1, a_t_1) - q))
                 else:
-                    Q[s_t][a_t] = Q[s_t][a_t] + alpha * (r - Q[s_t][a_t] + sum([
-                        bot.policy[s_t_1][a_t_1] * Q[s_t_1][a_t_1] for a_t_1 in bot.policy[s_t_1]
-                    ]))
+                    Q.set_by_index(i_t, j_t, q + alpha * (r - q + sum([
+                        bot.policy[s_t_1][a] * Q.get(s_t_1, a) for a in bot.policy[s_t_1]
+                    ])))
 
             # set s_t and a_t to the new state and action (we are doing on-policy control)
             s_t, a_t = s_t_1, a_t_1
@@ -57,26 +71,22 @@ def SARSA(bot:Bot, alpha=.5, epsilon=.1, gamma=1.0, num_episodes=1000, expected=
 
     return Q, total_rewards
 
-def expected_SARSA(bot:Bot, alpha=.5, epsilon=.1, gamma=1.0, num_episodes=1000):
-    return SARSA(bot, alpha, epsilon, gamma, num_episodes, expected=True)
+def expected_SARSA(bot:Bot, alpha=.5, epsilon=.1, gamma=1.0, num_episodes=1000, lazy=False, capacity=None):
+    return SARSA(bot, alpha, epsilon, gamma, num_episodes, expected=True, lazy=lazy, capacity=capacity)
 
 
-def Q_Learning(bot:Bot, alpha=.5, epsilon=.1, gamma=1.0, num_episodes=1000):
+def Q_Learning(bot:Bot, alpha=.5, epsilon=.1, gamma=1.0, num_episodes=1000, lazy=False, capacity=None):
     print("Performing Q-Learning...")
-    # init action-value function (tabular, finite)
-    # should we consider all states beforehand?
-    # Q = {}
-    Q = {s: {a: 0 for a in bot.env.actions} for s in bot.env.state_generator()}
+    # init action-value function (tabular, see init_Q)
+    Q = init_Q(bot, lazy, capacity)
+    # the policy of the bot is the greedy policy w.r.t. Q, it follows every update of Q
+    bot.set_greedy_policy(Q)
     total_rewards = [] # keep a list of total rewards for each episode
 
     for k in range(num_episodes):
         # reset the env
         bot.env.reset()
         episode_reward = 0
-        for s in Q.keys():
-            # update the policy of the bot
-            bot.policy_set_action(s, max(Q[s], key=Q[s].get))
-
         # initialize s
         s_t = bot.env.starting_state
         for t in range(bot.T):
@@ -89,14 +99,15 @@ def Q_Learning(bot:Bot, alpha=.5, epsilon=.1, gamma=1.0, num_episodes=1000):
             s_t_1 = bot.env.apply_action(s_t, a_t)
             r = bot.env.get_reward(s_t, a_t, s_t_1)
             episode_reward += r
-            # choose action a_t_1 from s_t_1 that maximizes Q[s_t_1]
-            a_t_1 = max(Q[s_t], key=Q[s_t].get)
-            # perform update of Q using SARSA update formula
+            # perform update of Q using the Q-learning update formula
             # if the next state is terminal, its future reward is zero
+            i_t, j_t = Q.index(s_t), Q.action_index[a_t]
+            q = Q.data[i_t, j_t]
             if bot.env.state_is_terminal(s_t_1):
-                Q[s_t][a_t] = Q[s_t][a_t] + alpha * (r - Q[s_t][a_t])
+                Q.set_by_index(i_t, j_t, q + alpha * (r - q))
             else:
-                Q[s_t][a_t] = Q[s_t][a_t] + alpha * (r + gamma * Q[s_t_1][a_t_1] - Q[s_t][a_t])
+                # the action a_t_1 from s_t_1 that maximizes Q[s_t_1] gives max_a Q[s_t_1][a]
+                Q.set_by_index(i_t, j_t, q + alpha * (r + gamma * Q.max_value(s_t_1) - q))
 
 
             # set s_t to the new state (off-policy control so a_t_1 does not get used)
@@ -106,22 +117,20 @@ def Q_Learning(bot:Bot, alpha=.5, epsilon=.1, gamma=1.0, num_episodes=1000):
 
 
 
-def Double_Q_Learning(bot:Bot, alpha=.5, epsilon=.1, gamma=1.0, num_episodes=1000):
+def Double_Q_Learning(bot:Bot, alpha=.5, epsilon=.1, gamma=1.0, num_episodes=1000, lazy=False, capacity=None):
     print("Performing Double-Q-Learning...")
-    # init 2 action-value functions (tabular, finite)
-    Q1 = {s: {a: 0 for a in bot.env.actions} for s in bot.env.state_generator()}
-    Q2 = {s: {a: 0 for a in bot.env.actions} for s in bot.env.state_generator()}
+    # init 2 action-value functions (tabular, see init_Q)
+    Q1 = init_Q(bot, lazy, capacity)
+    Q2 = init_Q(bot, lazy, capacity)
+    # Q1 + Q2, the policy of the bot is greedy w.r.t. it (and thus w.r.t. the mean action-value)
+    # it is updated together with the entry of Q1 or Q2 that changes
+    Q_sum = init_Q(bot, lazy, capacity)
+    bot.set_greedy_policy(Q_sum)
     total_rewards = []
     for k in range(num_episodes):
         # reset the env
         bot.env.reset()
         episode_reward = 0
-        for s in Q1.keys():
-            # update the policy of the bot
-            # get the action with the highest mean action-value
-            avg_action_values = {a:(Q1[s][a] + Q2[s][a])/2 for a in Q1[s].keys()}
-            bot.policy_set_action(s, max(avg_action_values, key=avg_action_values.get))
-
         # initialize s
         s_t = bot.env.starting_state
         for t in range(bot.T):
@@ -135,40 +144,44 @@ def Double_Q_Learning(bot:Bot, alpha=.5, epsilon=.1, gamma=1.0, num_episodes=100
             r = bot.env.get_reward(s_t, a_t, s_t_1)
             episode_reward += r
             # generate random uniform number, with a 50/50 chance swap them
-            u = random()
+            u = bot.rng.random()
             if u < .5:
                 Q1, Q2 = Q2, Q1
-            # choose action a_t_1 from s_t_1 that maximizes Q[s_t_1]
-            a_t_1 = max(Q1[s_t], key=Q1[s_t].get)
-            # perform update of Q using SARSA update formula
+            # perform update of Q1 using the Double-Q-learning update formula
             # if the next state is terminal, its future reward is zero
+            q = Q1.get(s_t, a_t)
             if bot.env.state_is_terminal(s_t_1):
-                Q1[s_t][a_t] = Q1[s_t][a_t] + alpha * (r - Q1[s_t][a_t])
+                Q1.set(s_t, a_t, q + alpha * (r - q))
             else:
-                Q1[s_t][a_t] = Q1[s_t][a_t] + alpha * (r + gamma * Q2[s_t_1][a_t_1] - Q1[s_t][a_t])
-
+                # choose action a_t_1 from s_t_1 that maximizes Q1[s_t_1], but evaluate it with Q2
+                a_t_1 = Q1.greedy_action(s_t_1)
+                Q1.set(s_t, a_t, q + alpha * (r + gamma * Q2.get(s_t_1, a_t_1) - q))
+            Q_sum.set(s_t, a_t, Q1.get(s_t, a_t) + Q2.get(s_t, a_t))
 
             # set s_t to the new state (off-policy control so a_t_1 does not get used)
             s_t = s_t_1
         total_rewards.append(episode_reward)
     # compute an average Q
-    Q = {s:{a:(Q1[s][a] + Q2[s][a])/2 for a in Q1[s].keys()} for s in Q1.keys()}
+    Q = Q_sum.copy()
+    Q.table = Q_sum.table / 2
     return Q, total_rewards
 
 
-def Speedy_Q_Learning(bot:Bot, alpha=None, gamma=1.0, epsilon=.1,  num_episodes=1000):
+def Speedy_Q_Learning(bot:Bot, alpha=None, gamma=1.0, epsilon=.1,  num_episodes=1000, lazy=False, capacity=None):
     print("Performing Speedy-Q-Learning...")
-    # init action-value function (tabular, finite)
-    Q = {s: {a: 0 for a in bot.env.actions} for s in bot.env.state_generator()}
+    # init action-value function (tabular, see init_Q)
+    Q = init_Q(bot, lazy, capacity)
+    # Q_prev is Q one update ago, the two only ever differ in the entry that was updated last,
+    # so it is kept in sync entry by entry instead of copying the whole table every step
+    Q_prev = Q.copy()
+    last_updated = None
+    # the policy of the bot is the greedy policy w.r.t. Q, it follows every update of Q
+    bot.set_greedy_policy(Q)
     total_rewards = []
     for k in range(num_episodes):
         # reset the env
         bot.env.reset()
         episode_reward = 0
-        for s in Q.keys():
-            # update the policy of the bot
-            bot.policy_set_action(s, max(Q[s], key=Q[s].get))
-
         # initialize s
         s_t = bot.env.starting_state
         for t in range(bot.T):
@@ -183,22 +196,21 @@ def Speedy_Q_Learning(bot:Bot, alpha=None, gamma=1.0, epsilon=.1,  num_episodes=
             s_t_1 = bot.env.apply_action(s_t, a_t)
             r = bot.env.get_reward(s_t, a_t, s_t_1)
             episode_reward += r
-            # choose action a_t_1 from s_t_1 that maximizes Q[s_t_1]
-            a_t_1 = max(Q[s_t], key=Q[s_t].get)
-            # perform update of Q using SARSA update formula
-            # before updating, save Q,r as Q_prev,r_prev
-            Q_prev = Q.copy()
-            r_prev = r
+            # perform update of Q using the Speedy-Q-learning update formula
+            # BQt is the Bellman target with the current Q, BQt_1 the one with Q_prev
             # if the next state is terminal, its future reward is zero
             if bot.env.state_is_terminal(s_t_1):
                 BQt = r
-                BQt_1 = r_prev
-                Q[s_t][a_t] = Q[s_t][a_t] + alpha_t * (BQt_1 - Q[s_t][a_t]) + (1 - alpha_t) * (BQt - BQt_1)
-
+                BQt_1 = r
             else:
-                BQt = r + gamma * Q[s_t_1][a_t_1]
-                BQt_1 = r_prev + gamma * Q_prev[s_t_1][max(Q_prev[s_t_1], key=Q_prev[s_t_1].get)]
-                Q[s_t][a_t] = Q[s_t][a_t] + alpha_t * (BQt_1 - Q[s_t][a_t]) + (1-alpha_t) * (BQt - BQt_1)
+                BQt = r + gamma * Q.max_value(s_t_1)
+                BQt_1 = r + gamma * Q_prev.max_value(s_t_1)
+            q = Q.get(s_t, a_t)
+            # Q_prev catches up with Q before Q changes
+            if last_updated is not None:
+                Q_prev.set(*last_updated, Q.get(*last_updated))
+            Q.set(s_t, a_t, q + alpha_t * (BQt_1 - q) + (1 - alpha_t) * (BQt - BQt_1))
+            last_updated = (s_t, a_t)
 
             # set s_t to the new state (off-policy control so a_t_1 does not get used)
             s_t = s_t_1
@@ -206,6 +218,239 @@ def Speedy_Q_Learning(bot:Bot, alpha=None, gamma=1.0, epsilon=.1,  num_episodes=
     return Q, total_rewards
 
 
+def Dyna_Q(bot:Bot, alpha=.5, epsilon=.1, gamma=1.0, num_episodes=1000, planning_steps=10, buffer_size=100000,
+           prioritized=False, lazy=False):
+    # Dyna-Q: Q-learning from every real step, plus planning_steps updates from a model after each step
+    # the model is the replay buffer of all (recent) transitions, sampling from it samples the learned
+    # dynamics, also of stochastic environments (see ReplayBuffer.py)
+    # the planning updates of one step are applied as one batch, all with the Q from before the batch
+    # (with a single step per state-action pair)
+    # prioritized: sample transitions with a large last TD error more often (prioritized sweeping with replay)
+    # the buffer stores row indices of Q, so the Q-table has no capacity here
+    print("Performing Dyna-Q...")
+    Q = init_Q(bot, lazy)
+    bot.set_greedy_policy(Q)
+    buffer = ReplayBuffer(buffer_size, rng=bot.rng)
+    total_rewards = []
+    for k in range(num_episodes):
+        episode_reward = 0
+        bot.env.reset()
+        s_t = bot.env.starting_state
+        for t in range(bot.T):
+            if bot.env.state_is_terminal(s_t):
+                break
+            a_t = bot.pick_action(s_t, epsilon)
+            s_t_1 = bot.env.apply_action(s_t, a_t)
+            r = bot.env.get_reward(s_t, a_t, s_t_1)
+            episode_reward += r
+            # direct Q-learning update, if the next state is terminal its future reward is zero
+            done = bot.env.state_is_terminal(s_t_1)
+            q = Q.get(s_t, a_t)
+            delta = r - q if done else r + gamma * Q.max_value(s_t_1) - q
+            Q.set(s_t, a_t, q + alpha * delta)
+            # model learning: remember the transition
+            buffer.add(Q.index(s_t), Q.action_index[a_t], r, Q.index(s_t_1), done, priority=abs(delta) + 1e-6)
+            # planning: Q-learning updates from simulated experience
+            if planning_steps:
+                idx, S, A, R, S_1, D = buffer.sample(planning_steps, prioritized=prioritized)
+                deltas = R + gamma * np.where(D, 0, Q.data[S_1, Q.best[S_1]]) - Q.data[S, A]
+                # a pair that was sampled several times gets one step with its mean TD error,
+                # summing the steps would overshoot while the buffer is still small
+                pairs, inverse, counts = np.unique(S * len(Q.actions) + A, return_inverse=True, return_counts=True)
+                mean_deltas = np.bincount(inverse, weights=deltas) / counts
+                Q.add_by_index(pairs // len(Q.actions), pairs % len(Q.actions), alpha * mean_deltas)
+                if prioritized:
+                    buffer.update_priorities(idx, np.abs(deltas) + 1e-6)
+            s_t = s_t_1
+        total_rewards.append(episode_reward)
+    return Q, total_rewards
+
+
+
+def epsilon_greedy_probabilities(Q, s, epsilon):
+    # action probabilities of the epsilon-greedy policy w.r.t. Q in state s; output: array (A,)
+    probs = np.full(len(Q.actions), epsilon / len(Q.actions))
+    probs[Q.action_index[Q.greedy_action(s)]] += 1 - epsilon
+    return probs
+
+
+def n_step_SARSA(bot:Bot, n=4, alpha=.5, epsilon=.1, gamma=1.0, num_episodes=1000, sigma=1.0, lazy=False, capacity=None):
+    # n-step Q(sigma) (Sutton & Barto 7.6), on-policy w.r.t. the epsilon-greedy policy
+    # sigma=1 samples every step like n-step SARSA, sigma=0 takes the expectation over the policy
+    # like the n-step tree backup, anything in between mixes both
+    print(f"Performing {n}-step Q(sigma={sigma})...")
+    Q = init_Q(bot, lazy, capacity)
+    bot.set_greedy_policy(Q)
+    total_rewards = []
+    for k in range(num_episodes):
+        episode_reward = 0
+        bot.env.reset()
+        # S_t, A_t and R_t of the episode so far (rewards[0] is unused)
+        states, actions, rewards = [bot.env.starting_state], [bot.pick_action(bot.env.starting_state, epsilon)], [0]
+        # time-step of the end of the episode (terminal state or step limit)
+        T_end = float("inf")
+        t = 0
+        while True:
+            if t < T_end:
+                if bot.env.state_is_terminal(states[t]):
+                    T_end = t
+                else:
+                    s_t_1 = bot.env.apply_action(states[t], actions[t])
+                    r = bot.env.get_reward(states[t], actions[t], s_t_1)
+                    episode_reward += r
+                    states.append(s_t_1)
+                    rewards.append(r)
+                    if bot.env.state_is_terminal(s_t_1) or t + 1 >= bot.T:
+                        T_end = t + 1
+                    else:
+                        actions.append(bot.pick_action(s_t_1, epsilon))
+            # tau is the time-step whose estimate gets updated now
+            tau = t - n + 1
+            if tau >= 0 and tau < T_end:
+                # the return is computed backwards from the bootstrap value of the last step
+                if t + 1 < T_end:
+                    g = Q.get(states[t + 1], actions[t + 1])
+                for h in range(min(t + 1, T_end), tau, -1):
+                    if h == T_end:
+                        g = rewards[h]
+                    else:
+                        probs = epsilon_greedy_probabilities(Q, states[h], epsilon)
+                        q_h = Q.table[Q.index(states[h])]
+                        j = Q.action_index[actions[h]]
+                        g = rewards[h] + gamma * ((sigma + (1 - sigma) * probs[j]) * (g - q_h[j]) + probs @ q_h)
+                q = Q.get(states[tau], actions[tau])
+                Q.set(states[tau], actions[tau], q + alpha * (g - q))
+            if tau >= T_end - 1:
+                break
+            t += 1
+        total_rewards.append(episode_reward)
+    return Q, total_rewards
+
+
+def TD_lambda(bot:Bot, lam=.9, alpha=.5, epsilon=.1, gamma=1.0, num_episodes=1000, q_learning=False,
+              traces="sparse", replacing=True, cutoff=1e-4, lazy=False, capacity=None):
+    # SARSA(lambda), or Watkins Q(lambda) if q_learning is set, with eligibility traces (see EligibilityTraces.py)
+    # traces: "sparse" (cost per step grows with the number of active traces) or "dense" (vectorized over all of Q)
+    # replacing: a visit sets the trace to 1 instead of adding 1, cutoff: traces below it are dropped
+    # Watkins Q(lambda) learns about the greedy policy, so its traces are cut after every exploratory action
+    if q_learning: print(f"Performing Watkins Q(lambda={lam})...")
+    else: print(f"Performing SARSA(lambda={lam})...")
+    Q = init_Q(bot, lazy, capacity)
+    bot.set_greedy_policy(Q)
+    Traces = DenseTraces if traces == "dense" else SparseTraces
+    E = Traces(Q, cutoff=cutoff, replacing=replacing)
+    total_rewards = []
+    for k in range(num_episodes):
+        episode_reward = 0
+        bot.env.reset()
+        E.clear()
+        s_t = bot.env.starting_state
+        a_t = bot.pick_action(s_t, epsilon)
+        for t in range(bot.T):
+            if bot.env.state_is_terminal(s_t):
+                break
+            s_t_1 = bot.env.apply_action(s_t, a_t)
+            r = bot.env.get_reward(s_t, a_t, s_t_1)
+            episode_reward += r
+            a_t_1 = bot.pick_action(s_t_1, epsilon)
+            # TD error, if the next state is terminal its future reward is zero
+            delta = r - Q.get(s_t, a_t)
+            explored = False
+            if not bot.env.state_is_terminal(s_t_1):
+                if q_learning:
+                    delta += gamma * Q.max_value(s_t_1)
+                    explored = Q.get(s_t_1, a_t_1) < Q.max_value(s_t_1)
+                else:
+                    delta += gamma * Q.get(s_t_1, a_t_1)
+            E.visit(Q.index(s_t), Q.action_index[a_t])
+            E.update(delta, alpha)
+            if explored:
+                E.clear()
+            else:
+                E.decay(gamma * lam)
+            s_t, a_t = s_t_1, a_t_1
+        total_rewards.append(episode_reward)
+    return Q, total_rewards
+
+
+def SARSA_lambda(bot:Bot, lam=.9, alpha=.5, epsilon=.1, gamma=1.0, num_episodes=1000, **kwargs):
+    return TD_lambda(bot, lam, alpha, epsilon, gamma, num_episodes, q_learning=False, **kwargs)
+
+
+def Watkins_Q_lambda(bot:Bot, lam=.9, alpha=.5, epsilon=.1, gamma=1.0, num_episodes=1000, **kwargs):
+    return TD_lambda(bot, lam, alpha, epsilon, gamma, num_episodes, q_learning=True, **kwargs)
+
+
+
+def epsilon_greedy_from_values(bot:Bot, s, q, epsilon):
+    # epsilon-greedy action in state s from its already computed action-values q (array in the order of bot.env.actions)
+    # like Bot.pick_action with a GreedyPolicy over a LinearQ, without computing the features of s again
+    if bot.rng.random() < epsilon:
+        return bot.rng.choice(bot.env.legal_actions(s))
+    return bot.env.actions[int(np.argmax(q))]
+
+
+def semi_gradient_TD(bot:Bot, features, alpha=.01, epsilon=.1, gamma=1.0, num_episodes=1000, batch_size=1, q_learning=False):
+    # semi-gradient SARSA or Q-learning with a linear action-value function q(s, a) = w_a . x(s) (see LinearQ.py)
+    # features: feature extractor x(s), e.g. TileFeatures or IndexFeatures
+    # batch_size: number of steps whose updates are collected and applied at once (1 updates after every step)
+    # q_learning: bootstrap from max_a q(s_t_1, a) instead of q(s_t_1, a_t_1)
+    if q_learning: print("Performing semi-gradient Q-Learning...")
+    else: print("Performing semi-gradient SARSA...")
+    Q = LinearQ(bot.env.actions, features)
+    # the policy of the bot is the greedy policy w.r.t. Q, it follows every update of the weights
+    bot.set_greedy_policy(Q)
+    total_rewards = []
+    # collected samples of the current batch: feature vector of s_t, index of a_t, target
+    X, J, targets = [], [], []
+    for k in range(num_episodes):
+        episode_reward = 0
+        bot.env.reset()
+        s_t = bot.env.starting_state
+        x_t = features(s_t)
+        a_t = None if bot.env.state_is_terminal(s_t) else epsilon_greedy_from_values(bot, s_t, Q.values(s_t, x_t), epsilon)
+        for t in range(bot.T):
+            if bot.env.state_is_terminal(s_t):
+                break
+            s_t_1 = bot.env.apply_action(s_t, a_t)
+            r = bot.env.get_reward(s_t, a_t, s_t_1)
+            episode_reward += r
+            # if the next state is terminal, its future reward is zero
+            if bot.env.state_is_terminal(s_t_1):
+                x_t_1, a_t_1 = None, None
+                target = r
+            else:
+                # the features and action-values of s_t_1 are computed once, for picking a_t_1, the target
+                # and the update in the next step
+                x_t_1 = features(s_t_1)
+                q_t_1 = Q.values(s_t_1, x_t_1)
+                a_t_1 = epsilon_greedy_from_values(bot, s_t_1, q_t_1, epsilon)
+                target = r + gamma * (q_t_1.max() if q_learning else q_t_1[Q.action_index[a_t_1]])
+            if batch_size == 1:
+                Q.update(x_t, Q.action_index[a_t], target, alpha)
+            else:
+                X.append(x_t)
+                J.append(Q.action_index[a_t])
+                targets.append(target)
+                if len(X) == batch_size:
+                    Q.update_batch(np.array(X), np.array(J), np.array(targets), alpha)
+                    X, J, targets = [], [], []
+            s_t, x_t, a_t = s_t_1, x_t_1, a_t_1
+        total_rewards.append(episode_reward)
+    if X:
+        Q.update_batch(np.array(X), np.array(J), np.array(targets), alpha)
+    return Q, total_rewards
+
+
+def semi_gradient_SARSA(bot:Bot, features, alpha=.01, epsilon=.1, gamma=1.0, num_episodes=1000, batch_size=1):
+    return semi_gradient_TD(bot, features, alpha, epsilon, gamma, num_episodes, batch_size, q_learning=False)
+
+
+def semi_gradient_Q_Learning(bot:Bot, features, alpha=.01, epsilon=.1, gamma=1.0, num_episodes=1000, batch_size=1):
+    return semi_gradient_TD(bot, features, alpha, epsilon, gamma, num_episodes, batch_size, q_learning=True)
+
+
+
 def test_grid_world(algo=SARSA, print_q=False, alpha = .2, epsilon = .3, gamma = .9, num_episodes=1000):
     print(f"Testing {algo.__name__} on Grid-World...")
     # init env
@@ -247,6 +492,45 @@ def test_cliff_walking(algo=SARSA, print_q=False, alpha = .2, epsilon = .3, gamm
     print("-"*50)
 
 
+def test_trend_process(algo=Q_Learning, alpha = .1, epsilon = .1, gamma = .99, num_episodes=2000, T=100):
+    print(f"Testing {algo.__name__} on the Autoregressive-Trend-Process...")
+    # the float states of the trend process are mapped to bins, so the Q-table has a fixed size
+    trend_process = AutoregressiveTrendProcess(T=T)
+    trend_process.set_start()
+    env = DiscretizedEnvironment(trend_process, trend_process.discretizer())
+    print(env)
+    bot = Bot(env, T=T)
+    Q, total_rewards = algo(bot, alpha=alpha, epsilon=epsilon, gamma=gamma, num_episodes=num_episodes)
+    plot_blockwise_mean_rewards_line_graph(total_rewards, title=f"Total Rewards {algo.__name__}", xlabel="episodes", ylabel="reward")
+    print("-"*50)
+
+def test_cliff_walking_linear(algo=semi_gradient_Q_Learning, alpha = .2, epsilon = .3, gamma = .9, num_episodes=2000):
+    print(f"Testing {algo.__name__} on Cliff-Walking...")
+    h, w = 4, 5
+    cliffs = [(1, 1), (1, 2), (1, 3)]
+    env = CliffWalking(h, w, terminal_states=[(1, 4)], starting_state=(1, 0), cliffs=cliffs)
+    print(env)
+    bot = Bot(env, initialize_policy=False)
+    # one-hot features of the cell index
+    features = IndexFeatures(env.encode_state, h * w)
+    Q, total_rewards = algo(bot, features, alpha=alpha, epsilon=epsilon, gamma=gamma, num_episodes=num_episodes)
+    env.grid.draw_grid({s: env.action_str(Q.greedy_action(s)) for s in env.state_generator()})
+    plot_blockwise_mean_rewards_line_graph(total_rewards, title=f"Total Rewards {algo.__name__}", xlabel="episodes", ylabel="reward")
+    print("-"*50)
+
+
+def test_trend_process_linear(algo=semi_gradient_Q_Learning, alpha = .01, epsilon = .1, gamma = .99, num_episodes=2000, T=100):
+    print(f"Testing {algo.__name__} on the Autoregressive-Trend-Process...")
+    env = AutoregressiveTrendProcess(T=T)
+    env.set_start()
+    # tile coding of the trend process features (price position in its range, previous action, time)
+    tile_coder = TileCoder(low=[0, -1, 0], high=[1, 1, 1], n_tiles=[8, 2, 4], n_tilings=8, features=env.features)
+    bot = Bot(env, T=T, initialize_policy=False)
+    Q, total_rewards = algo(bot, TileFeatures(tile_coder), alpha=alpha / tile_coder.n_tilings, epsilon=epsilon,
+                            gamma=gamma, num_episodes=num_episodes)
+    plot_blockwise_mean_rewards_line_graph(total_rewards, title=f"Total Rewards {algo.__name__}", xlabel="episodes", ylabel="reward")
+    print("-"*50)
+
 if __name__ == '__main__':
     test_grid_world(SARSA)
     # test_grid_world(expected_SARSA)
@@ -1,3 +1,5 @@
+import numpy as np
+
 from GridWorld import GridWorld
 
 class WindyGridWorld(GridWorld):
@@ -17,8 +19,8 @@ class WindyGridWorld(GridWorld):
         # use the GridWorld.action_mappings for this
         for x, f in enumerate(forces):
             for y in range(h):
-                if (y, x) not in terminal_states + [starting_state]:
-                    self.put_onto_grid({(y, x): GridWorld.action_mappings[str(f)]})
+                if (y, x) not in self.terminal_set and (y, x) != starting_state:
+                    self.put_onto_grid({(y, x): GridWorld.action_mappings[tuple(f)]})
 
     def apply_action(self, state, action):
         # Computes the new state after applying an action and wind force.
@@ -37,6 +39,22 @@ class WindyGridWorld(GridWorld):
             new_state_shifted = new_state
         return new_state_shifted
 
+    def apply_action_batch(self, states, actions, rng):
+        # Vectorized apply_action: move, then get pushed by the wind of the new column,
+        # a push that would leave the grid is ignored.
+        # Inputs:
+        #   states (int array): Current cell indices
+        #   actions (int array): Indices into self.actions
+        #   rng: Random generator (unused, the wind is deterministic)
+        # Output:
+        #   int array: New cell indices
+        new_states = self.move_batch(states, actions)
+        y, x = np.divmod(new_states, self.width)
+        forces = np.array(self.forces, dtype=np.int64)[x]
+        shifted_y, shifted_x = y + forces[:, 0], x + forces[:, 1]
+        out_of_bounds = (shifted_y < 0) | (shifted_y >= self.height) | (shifted_x < 0) | (shifted_x >= self.width)
+        return np.where(out_of_bounds, new_states, shifted_y * self.width + shifted_x)
+
 
 
 if __name__ == "__main__":